@@ -1,26 +1,115 @@
 import streamlit as st
 import pandas as pd
-from pathlib import Path
-from functions import load_parts, load_product, get_available_decisions, build_bom_perfiles, build_bom_accesorios, get_product_by_name, render_product_card, load_stock
-from cutting_stock import cutting_stock_with_kerf
-from pdf import generate_pdf
+from catalog import CatalogError, load_catalog_cached, get_available_decisions, build_bom_basket, get_product_by_name
+from functions import render_product_card, load_stock, load_stock_index, save_stock
+from pricing import build_quote, discounted, percentage
+from stock import update_stock_with_plan
+from cutting_stock import lower_bound
+from cutting_jobs import CuttingJob, inputs_key
+from pdf import generate_pdf, plan_key
+from solution_cache import SolutionCache
+from stock_store import StockConflict
+import telemetry
 import json
+import os
 from io import StringIO
 
 st.set_page_config(
     page_title="PROYECTO PINARDI",
 )
 
-# --- Load parts ---
-parts = load_parts("parts.yaml")
+telemetria = telemetry.start_run()
+
+MOTORES_CORTE = {
+    "Exacto (CP-SAT)": "cp-sat",
+    "Generación de columnas": "column-generation",
+    "Heurístico (instantáneo)": "heuristic",
+}
+
+SOLUTION_CACHE = SolutionCache()
+
+BARRA_NUEVA = "Barra nueva"
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def pdf_lista_de_cortes(clave, _df_cuts_flat, _parts):
+    """Cut-list PDF bytes, cached by the plan hash (clave)."""
+    return generate_pdf(df_cuts_flat=_df_cuts_flat, parts=_parts).getvalue()
+
+
+def estado_del_motor(stats):
+    """Status of the solve that made the plan, also for plans reused from the previous job."""
+    return stats.get("previous_status") if stats.get("status") == "REUSED" else stats.get("status")
+
+
+def optimo_demostrado(stats):
+    """True when the OPTIMAL status of a solve proves the plan optimal."""
+    if estado_del_motor(stats) != "OPTIMAL":
+        return False
+    if "lp_bound" in stats:
+        # column generation: its integer master only covers the generated patterns
+        return stats.get("bars") is not None and stats["bars"] <= max(stats["lp_bound"], stats.get("lower_bound", 0))
+    return True
+
+
+def estado_del_plan(gap, stats, terminado, detenido):
+    """Label telling a proven plan from a time-limited or provisional one."""
+    if not terminado:
+        return "⏹️ detenido" if detenido else "⏳ mejorando"
+    if gap == 0 or optimo_demostrado(stats):
+        return "✅ óptimo"
+    if estado_del_motor(stats) in ("OPTIMAL", "FEASIBLE"):
+        return "sin óptimo demostrado" if "lp_bound" in stats else "⏱️ límite de tiempo"
+    if estado_del_motor(stats) == "HEURISTIC":
+        return "heurístico"
+    return ""
+
+
+def plan_de_cortes(to_cut, planes, parts, kerf, descarte_punta):
+    """Per-code summaries and flat cut list of the current plan of each code."""
+    res_cuts = []
+    for k, (bars, leftovers, origins) in planes.items():
+        v = to_cut[k]
+        res_cuts.append({
+            "codigo": k,
+            "total_barras": len(bars),
+            "cota_inferior": lower_bound(v["stock_length"], v["pieces"], kerf=kerf, edge_trim=descarte_punta),
+            "usa_stock": any(origins or []),
+            "detalle": [
+                {"Barra #": i+1, "Cortes": bars[i], "Sobrante": leftovers[i], "Origen": (origins or [None] * len(bars))[i]}
+                for i in range(len(bars))
+            ]
+        })
+
+    rows = []
+    for res in res_cuts:
+        for d in res["detalle"]:
+            rows.append({
+                "Código": res["codigo"],
+                "Barra #": d["Barra #"],
+                "Origen": BARRA_NUEVA if d["Origen"] is None else f"{d['Origen']['posicion']} ({d['Origen']['largo']} mm)",
+                "kg/m": parts[res["codigo"]]["kg/m"],
+                "Cortes": ", ".join(str(c) for c in d["Cortes"]),
+                "mm. usados": sum(d["Cortes"]),
+                "kg. usados": (sum(d["Cortes"])/1000) * parts[res["codigo"]]["kg/m"],
+                "mm. sobrantes": d["Sobrante"],
+                "kg. sobrantes": (d["Sobrante"]/1000) * parts[res["codigo"]]["kg/m"]
+            })
+
+    return res_cuts, pd.DataFrame(rows).sort_values(["Código", "Barra #"])
 
-# --- Load all product YAMLs ---
-product_files = list(Path(".").glob("product_*.yaml"))
-if not product_files:
+# --- Load parts and all product YAMLs (compiled once, shared by every session) ---
+try:
+    with telemetry.stage("catalogo"):
+        catalog = load_catalog_cached(".")
+except CatalogError as e:
+    st.error(f"Error en el catálogo de productos: {e}")
+    st.stop()
+if not catalog.products:
     st.error("No se encontró ningún archivo YAML que defina un producto!")
     st.stop()
-
-products = [load_product(pf) for pf in product_files]
+parts = catalog.parts
+products = catalog.products
 product_names = [p["tipologia"] for p in products]
 
 # --- Initialize session state ---
@@ -69,6 +158,35 @@ with tab1:
     st.sidebar.write("## Opciones generales")
     kerf = st.sidebar.number_input("🪚 Ancho de la hoja de corte (mm)", value=5, step=1, min_value=0, format="%d")
     descarte_punta=st.sidebar.number_input("🪚 Descarte de punta (mm, por lado)", value=50, step=1, min_value=0, format="%d")
+    motor_cortes = st.sidebar.selectbox(
+        "🧮 Motor de cálculo de cortes",
+        list(MOTORES_CORTE),
+        help="El exacto (CP-SAT) demuestra el óptimo solo en códigos chicos: en los grandes pasa solo a "
+             "generación de columnas, que escala a miles de cortes por código pero puede no demostrar el óptimo; "
+             "el heurístico responde al instante e informa la distancia (gap) a la cota inferior."
+    )
+    sobrante_reutilizable = st.sidebar.number_input(
+        "♻️ Sobrante reutilizable (mm)", value=500, step=50, min_value=0, format="%d",
+        help="El motor exacto concentra el desperdicio en sobrantes de al menos este largo. "
+             "Al confirmar el pedido se agregan al stock. 0 = desactivado."
+    )
+    usar_stock = st.sidebar.checkbox(
+        "📦 Usar barras del stock primero",
+        help="Corta primero de los sobrantes registrados en Control de stock y compra barras nuevas solo para el resto."
+    )
+    col_procesos, col_nucleos = st.sidebar.columns(2)
+    with col_procesos:
+        procesos_corte = st.number_input("⚙️ Procesos en paralelo", value=os.cpu_count() or 1, step=1, min_value=1, format="%d",
+                                         help="Cantidad de códigos que se calculan a la vez.")
+    with col_nucleos:
+        nucleos_corte = st.number_input("🧠 Núcleos totales", value=int(os.environ.get("CPSAT_WORKERS") or 0) or os.cpu_count() or 1,
+                                        step=1, min_value=1, format="%d",
+                                        help="Núcleos repartidos entre los códigos que se calculan a la vez (CPSAT_WORKERS).")
+    semilla_cortes = st.sidebar.number_input(
+        "🎲 Semilla del motor exacto", value=int(os.environ["CPSAT_SEED"]) if os.environ.get("CPSAT_SEED") else None,
+        step=1, min_value=0, format="%d",
+        help="Fija la búsqueda de CP-SAT para repetir un plan o probar otro (CPSAT_SEED). Vacío = la del motor."
+    )
 
     st.subheader("Agregar producto")
     
@@ -152,7 +270,7 @@ with tab1:
     if st.session_state.basket:
         st.subheader("Productos agregados")
         for i, p in enumerate(st.session_state.basket):
-            product = get_product_by_name(p["product_name"], products)
+            product = get_product_by_name(p["product_name"], catalog.by_name)
             render_product_card(i, p, product, parts)
 
   
@@ -178,35 +296,19 @@ with tab2:
         st.stop()
 
 
+# BOMs of the whole selection, shared by tabs 3 and 4
+with telemetry.stage("bom"):
+    df_perfiles_basket, df_accesorios_basket, demanda_cortes = build_bom_basket(
+        [st.session_state.basket[i] for i in selected_indices], catalog.by_name, parts
+    )
+
 with tab3:
     # -------------------------------------------------------------
     # PERFILES
     # -------------------------------------------------------------
     with st.expander("Lista de perfiles"):
 
-        all_boms_perfiles = []
-        for idx in selected_indices:
-            selected_item = st.session_state.basket[idx]
-
-            # Recover product
-            product = get_product_by_name(selected_item["product_name"], products)
-
-            bom = build_bom_perfiles(
-                selected_item["selection"], 
-                product, 
-                parts, 
-                selected_item["ancho"], 
-                selected_item["alto"]
-            )
-            
-            for row in bom:
-                row["producto"] = selected_item["description"]
-                row["cantidad"] = row["cantidad"] * selected_item["cantidad"]
-            
-            all_boms_perfiles.extend(bom)
-
-        df_perfiles = pd.DataFrame(all_boms_perfiles)
-        df_perfiles = df_perfiles[["producto", "codigo", "descripcion", "especificacion_medida", "medida_calculada", "cantidad"]]
+        df_perfiles = df_perfiles_basket[["producto", "codigo", "descripcion", "especificacion_medida", "medida_calculada", "cantidad"]]
         st.dataframe(df_perfiles, use_container_width=True)
 
     # -------------------------------------------------------------
@@ -214,16 +316,24 @@ with tab3:
     # -------------------------------------------------------------
     with st.expander("Cálculo de cortes"):
 
-        to_cut = {}
-        for _, row in df_perfiles.iterrows():
-            to_cut.setdefault(row["codigo"], {"pieces": []})
-            to_cut[row["codigo"]]["pieces"].extend([row["medida_calculada"]] * row["cantidad"])
+        # (length, count) pairs per code
+        to_cut = {codigo: {"pieces": piezas} for codigo, piezas in demanda_cortes.items()}
+
+        stock_index = None
+        if usar_stock:
+            try:
+                stock_index = load_stock_index()
+            except Exception as e:
+                st.warning(f"⚠️ No se pudo leer el stock, se calcula con barras nuevas.\n\n{e}")
 
         for k, v in to_cut.items():
             v["stock_length"] = parts[k]["largo"]
+            # only remnants long enough for the shortest piece of the code
+            largo_minimo = min(l for l, _ in v["pieces"]) + 2 * descarte_punta
+            v["remnants"] = stock_index.at_least(k, largo_minimo) if stock_index else []
 
         piezas_invalidas = any(
-            any(p > v["stock_length"] for p in v["pieces"])
+            any(l > v["stock_length"] for l, _ in v["pieces"])
             for v in to_cut.values()
         )
 
@@ -231,63 +341,187 @@ with tab3:
             st.warning("⚠️ Hay piezas a cortar mayores al largo de la barra.")
             st.stop()
 
-        res_cuts = []
-        for k, v in to_cut.items():
-            bars, leftovers = cutting_stock_with_kerf(v["stock_length"], v["pieces"], kerf=kerf, edge_trim=descarte_punta)
-            res_cuts.append({
-                "codigo": k,
-                "total_barras": len(bars),
-                "detalle": [
-                    {"Barra #": i+1, "Cortes": bars[i], "Sobrante": leftovers[i]}
-                    for i in range(len(bars))
-                ]
-            })
+        # Solved in the background: the page shows the best plan so far and
+        # a new job replaces the running one when the inputs change. The new
+        # job keeps the plans of unchanged codes and re-solves the rest
+        # starting from their previous plan.
+        opciones_corte = {
+            "engine": MOTORES_CORTE[motor_cortes],
+            "kerf": kerf,
+            "edge_trim": descarte_punta,
+            "min_remnant": sobrante_reutilizable or None,
+            "seed": semilla_cortes,
+        }
+        clave_cortes = inputs_key(to_cut, **opciones_corte)
+        trabajo = st.session_state.get("trabajo_cortes")
+        with telemetry.stage("cortes", motor=MOTORES_CORTE[motor_cortes], codigos=len(to_cut)):
+            if trabajo is None or trabajo.key != clave_cortes:
+                if trabajo is not None:
+                    trabajo.cancel()
+                trabajo = st.session_state.trabajo_cortes = CuttingJob(
+                    to_cut, key=clave_cortes, previous=trabajo, max_workers=procesos_corte, cpu_budget=nucleos_corte,
+                    cache=SOLUTION_CACHE, **opciones_corte
+                )
+                # items feeding each code, to tell which edits caused the re-solve
+                items_previos, codigos_previos = st.session_state.get("items_cortes", ({}, {}))
+                items_actuales = {st.session_state.basket[i]["description"]: st.session_state.basket[i] for i in selected_indices}
+                codigos_por_item = df_perfiles_basket.groupby("producto")["codigo"].agg(set).to_dict()
+                st.session_state.items_cortes = (items_actuales, codigos_por_item)
+                cambios = sorted(
+                    d for d in items_actuales.keys() | items_previos.keys()
+                    if items_actuales.get(d) != items_previos.get(d)
+                )
+                afectados = set().union(*(codigos_por_item.get(d, codigos_previos.get(d, set())) for d in cambios))
+                st.session_state.cambios_cortes = (cambios, afectados)
+            with st.spinner("Calculando cortes..."):
+                trabajo.wait_for_plans()
+        if trabajo.error is not None:
+            st.error(f"Error en el cálculo de cortes.\n\n{trabajo.error}")
+            st.stop()
+        # done first: a job ending between the two reads then leaves en_curso
+        # set and the fragment reruns the page with the final plans
+        en_curso = not trabajo.done
+        _, planes, _ = trabajo.snapshot()
+        telemetria.solves.update(dict(trabajo.stats))
+        res_cuts, df_cuts_flat = plan_de_cortes(to_cut, planes, parts, kerf, descarte_punta)
+
+        cache_stats = SOLUTION_CACHE.stats()
+        st.caption(
+            f"Caché de soluciones: {cache_stats['hits']} aciertos | {cache_stats['misses']} fallos | "
+            f"{cache_stats['entries']} planes guardados"
+        )
+        cambios, afectados = st.session_state.get("cambios_cortes", ([], set()))
+        if trabajo.reused:
+            st.caption(
+                f"♻️ Se recalculan {len(to_cut) - len(trabajo.reused)} de {len(to_cut)} códigos "
+                f"(cambios en: {', '.join(cambios) or 'opciones'}; códigos afectados: "
+                f"{', '.join(str(c) for c in sorted(afectados)) or '-'})."
+            )
 
-        rows = []
-        for res in res_cuts:
-            for d in res["detalle"]:
-                rows.append({
-                    "Código": res["codigo"],
-                    "Barra #": d["Barra #"],
-                    "kg/m": parts[res["codigo"]]["kg/m"],
-                    "Cortes": ", ".join(str(c) for c in d["Cortes"]),
-                    "mm. usados": sum(d["Cortes"]),
-                    "kg. usados": (sum(d["Cortes"])/1000) * parts[res["codigo"]]["kg/m"],
-                    "mm. sobrantes": d["Sobrante"],
-                    "kg. sobrantes": (d["Sobrante"]/1000) * parts[res["codigo"]]["kg/m"]
-                })
-
-        df_cuts_flat = pd.DataFrame(rows).sort_values(["Código", "Barra #"])
+        # The lower bound only applies to plans made entirely of new bars
+        if not en_curso and any(
+            res["total_barras"] > res["cota_inferior"]
+            and estado_del_motor(trabajo.stats.get(res["codigo"], {})) != "CACHE"
+            and not optimo_demostrado(trabajo.stats.get(res["codigo"], {}))
+            for res in res_cuts if not res["usa_stock"]
+        ):
+            st.info("ℹ️ Hay códigos con gap mayor a cero sin óptimo demostrado: el motor exacto podría ahorrar barras.")
 
         kg_comprados = 0
         for codigo, group in df_cuts_flat.groupby("Código"):
-            st.write(
-                f"**{codigo} - {parts[codigo]['descripcion']}**  \n"
-                f"total barras: {len(group)} | usados: {group['mm. usados'].sum():.0f} (mm) - "
-                f"{group['kg. usados'].sum():.2f} (kg) | sobrantes: {group['mm. sobrantes'].sum():.0f} (mm) - "
-                f"{group['kg. sobrantes'].sum():.2f} (kg)"
+            nuevas = int((group["Origen"] == BARRA_NUEVA).sum())
+            kg_comprados += nuevas * parts[codigo]["kg/m"] * (parts[codigo]["largo"]/1000)
+
+        @st.fragment(run_every=1.0 if en_curso else None)
+        def avance_de_cortes():
+            """Current best plan, polled while the background solve improves it."""
+            if en_curso and trabajo.done:
+                st.rerun()  # totals, purchase list and stock update follow the final plan
+            _, planes, terminados = trabajo.snapshot()
+            res_vivo, df_vivo = plan_de_cortes(to_cut, planes, parts, kerf, descarte_punta)
+
+            if en_curso:
+                col_avance, col_detener = st.columns([3, 1])
+                col_avance.info(
+                    f"⏳ Mejorando el plan: {len(terminados)} de {len(to_cut)} códigos terminados. "
+                    "Se muestra el mejor plan encontrado hasta ahora."
+                )
+                if col_detener.button("⏹️ Detener"):
+                    trabajo.cancel()
+            elif trabajo.cancelled:
+                st.caption("Cálculo detenido: se usa el mejor plan encontrado.")
+
+            # The lower bound only applies to plans made entirely of new bars
+            cotas = {res["codigo"]: res["cota_inferior"] for res in res_vivo if not res["usa_stock"]}
+            for codigo, group in df_vivo.groupby("Código"):
+                nuevas = int((group["Origen"] == BARRA_NUEVA).sum())
+                if codigo in cotas:
+                    gap = len(group) - cotas[codigo]
+                    detalle_cota = f"cota inferior: {cotas[codigo]} | gap: {gap} ({gap / cotas[codigo]:.0%})"
+                else:
+                    detalle_cota = f"de stock: {len(group) - nuevas} | nuevas: {nuevas}"
+                estado = estado_del_plan(
+                    len(group) - cotas[codigo] if codigo in cotas else None,
+                    trabajo.stats.get(codigo, {}),
+                    codigo in terminados,
+                    trabajo.cancelled,
+                )
+                st.write(
+                    f"**{codigo} - {parts[codigo]['descripcion']}** {estado}  \n"
+                    f"total barras: {len(group)} | {detalle_cota} | "
+                    f"usados: {group['mm. usados'].sum():.0f} (mm) - "
+                    f"{group['kg. usados'].sum():.2f} (kg) | sobrantes: {group['mm. sobrantes'].sum():.0f} (mm) - "
+                    f"{group['kg. sobrantes'].sum():.2f} (kg)"
+                )
+                st.dataframe(group.drop(columns="Código").round(2), use_container_width=True, hide_index=True)
+
+            ### PDF DE LISTA DE CORTES ###
+            # built only when downloaded, and once per distinct plan
+            df_pdf = df_vivo[["Código", "Barra #", "Origen", "Cortes"]]
+            clave_pdf = plan_key(df_pdf)
+            st.download_button(
+                label="📥 Descargar lista de cortes",
+                data=lambda: pdf_lista_de_cortes(clave_pdf, df_pdf, parts),
+                file_name="calculo_de_cortes.pdf",
+                mime="application/pdf"
             )
-            st.dataframe(group.drop(columns="Código").round(2), use_container_width=True, hide_index=True)
-            kg_comprados += len(group) * parts[codigo]["kg/m"] * (parts[codigo]["largo"]/1000)
 
-        ### PDF DE LISTA DE CORTES ###
-        pdf_buffer = generate_pdf(
-            df_cuts_flat=df_cuts_flat[["Código", "Barra #", "Cortes"]],
-            parts=parts,
-        )
-        st.download_button(
-            label="📥 Descargar lista de cortes",
-            data=pdf_buffer,
-            file_name="calculo_de_cortes.pdf",
-            mime="application/pdf"
-        )
+        avance_de_cortes()
         
     # -------------------------------------------------------------
     # LISTA DE PERFILES A PEDIR
     # -------------------------------------------------------------
     with st.expander("Lista de perfiles a comprar"):
-        df_perf_a_comprar=(df_cuts_flat.groupby(["Código"]).agg("count")["Barra #"]).rename("Cantidad de barras")
+        df_nuevas = df_cuts_flat[df_cuts_flat["Origen"] == BARRA_NUEVA]
+        df_perf_a_comprar=(df_nuevas.groupby(["Código"]).agg("count")["Barra #"]).rename("Cantidad de barras")
         st.dataframe(df_perf_a_comprar)
+
+    # -------------------------------------------------------------
+    # CONFIRMAR PEDIDO: ACTUALIZAR STOCK
+    # -------------------------------------------------------------
+    with st.expander("♻️ Confirmar pedido y actualizar stock"):
+        posicion_sobrantes = st.text_input("Posición para los sobrantes", value="sobrantes")
+
+        barras_usadas = [d["Origen"] for res in res_cuts for d in res["detalle"] if d["Origen"] is not None]
+        sobrantes = [
+            {"posicion": posicion_sobrantes, "codigo": res["codigo"], "largo": int(d["Sobrante"])}
+            for res in res_cuts
+            for d in res["detalle"]
+            if sobrante_reutilizable and d["Sobrante"] >= sobrante_reutilizable
+        ]
+
+        st.write(f"Barras de stock a consumir: **{len(barras_usadas)}** | sobrantes a agregar: **{len(sobrantes)}**")
+        if barras_usadas:
+            st.dataframe(pd.DataFrame(barras_usadas), use_container_width=True, hide_index=True)
+        if sobrantes:
+            st.dataframe(pd.DataFrame(sobrantes), use_container_width=True, hide_index=True)
+
+        # an order updates the stock once. Keyed on its demand and options, not
+        # on the plan or the remnants: after saving, the stock changes and the
+        # order is planned again, possibly with the remnants it just stored.
+        clave_pedido = inputs_key(
+            {codigo: {k: v for k, v in job.items() if k != "remnants"} for codigo, job in to_cut.items()},
+            **opciones_corte,
+        )
+        confirmado = st.session_state.get("pedido_confirmado") == clave_pedido
+        if en_curso:
+            st.caption("⏳ Se podrá confirmar cuando termine el cálculo de cortes (o al detenerlo).")
+        elif confirmado:
+            st.success("✅ Stock actualizado con este plan.")
+        if st.button("✅ Confirmar pedido", disabled=en_curso or confirmado or not (barras_usadas or sobrantes)):
+            try:
+                with st.spinner("Actualizando stock..."):
+                    stock_actual, sha = load_stock(fresh=True)
+                    save_stock(update_stock_with_plan(stock_actual, barras_usadas, sobrantes), sha)
+                st.session_state.pedido_confirmado = clave_pedido
+                st.rerun()  # shows the plan as confirmed, with the button disabled
+            except StockConflict as e:
+                barras = ", ".join(f"{b['codigo']} de {b['posicion']} ({b['largo']} mm)" for b in e.conflicts)
+                st.error(f"Otra persona ya usó o modificó estas barras: {barras or e}. Vuelva a calcular los cortes.")
+            except ValueError as e:
+                st.error(f"{e} Vuelva a calcular los cortes.")
+            except Exception as e:
+                st.error(f"No se pudo guardar el archivo en GitHub.\n\n{e}")
         
     
     ### RESUMEN LISTA DE CORTES ### 
@@ -329,23 +563,7 @@ with tab4:
     # ACCESORIOS
     # -------------------------------------------------------------
 
-    all_boms_accesorios = []
-    for idx in selected_indices:
-        selected_item = st.session_state.basket[idx]
-        product = get_product_by_name(selected_item["product_name"], products)
-
-        bom = build_bom_accesorios(
-            selected_item["selection"],
-            product,
-            parts
-        )
-        for row in bom:
-            row["producto"] = selected_item["description"]
-            row["cantidad"] = row["cantidad"] * selected_item["cantidad"]
-        all_boms_accesorios.extend(bom)
-
-    df_accesorios = pd.DataFrame(all_boms_accesorios)
-    df_accesorios = df_accesorios[
+    df_accesorios = df_accesorios_basket[
         ["producto", "codigo", "descripcion", "cantidad", "precio unidad", "precio total"]
     ]
     
@@ -380,7 +598,7 @@ with tab4:
         )
 
     # Calcular subtotal con descuento
-    subtotal_accesorios = subtotal_accesorios_bruto * (1 - desc_accesorios / 100)
+    subtotal_accesorios = discounted(subtotal_accesorios_bruto, desc_accesorios)
 
     st.markdown("---")
     st.markdown(f"### 🧾 Subtotal accesorios: **${subtotal_accesorios:,.2f}**")
@@ -405,15 +623,15 @@ with tab6:
 
     with col1:
         perc_perfiles = st.number_input("Perfiles (%)", min_value=0.0, max_value=100.0, step=1.0)
-        margen_perfiles = subtotal_perfiles * perc_perfiles / 100
+        margen_perfiles = percentage(subtotal_perfiles, perc_perfiles)
 
     with col2:
         perc_accesorios = st.number_input("Accesorios (%)", min_value=0.0, max_value=100.0, step=1.0)
-        margen_accesorios = subtotal_accesorios * perc_accesorios / 100
+        margen_accesorios = percentage(subtotal_accesorios, perc_accesorios)
 
     with col3:
         perc_vidrios = st.number_input("Vidrios (%)", min_value=0.0, max_value=100.0, step=1.0)
-        margen_vidrios = subtotal_vidrios * perc_vidrios / 100
+        margen_vidrios = percentage(subtotal_vidrios, perc_vidrios)
 
 
     st.subheader("Costos adicionales")
@@ -429,22 +647,6 @@ with tab6:
     with colC:
         margen_adicional = st.number_input("Margen adicional", value=0.0, format="%.2f")
 
-    data = {
-        "Concepto": [
-            "Subtotal perfiles", "Margen perfiles",
-            "Subtotal accesorios", "Margen accesorios",
-            "Subtotal vidrios", "Margen vidrios",
-            "Mano de obra", "Insumos", "Margen adicional"
-        ],
-        "Valor": [
-            subtotal_perfiles, margen_perfiles,
-            subtotal_accesorios, margen_accesorios,
-            subtotal_vidrios, margen_vidrios,
-            mano_obra, insumos, margen_adicional
-        ]
-    }
-    df = pd.DataFrame(data)
-
     st.subheader("IVA")
     iva_option = st.radio(
         "",
@@ -452,18 +654,17 @@ with tab6:
         label_visibility="collapsed"
     )
 
-    if iva_option == "a todo":
-        df["Multiplicador"] = 1.22
-    else:
-        df["Multiplicador"] = df["Concepto"].apply(
-            lambda c: 1.22 if c in ["Subtotal perfiles", "Subtotal accesorios", "Subtotal vidrios"] else 1.00
+    with telemetry.stage("cotizacion"):
+        df, total_sin_iva, total_iva_incluido = build_quote(
+            {
+                "Subtotal perfiles": subtotal_perfiles, "Margen perfiles": margen_perfiles,
+                "Subtotal accesorios": subtotal_accesorios, "Margen accesorios": margen_accesorios,
+                "Subtotal vidrios": subtotal_vidrios, "Margen vidrios": margen_vidrios,
+                "Mano de obra": mano_obra, "Insumos": insumos, "Margen adicional": margen_adicional,
+            },
+            iva_a_todo=iva_option == "a todo",
         )
 
-    df["Total"] = df["Valor"] * df["Multiplicador"]
-
-    total_sin_iva = df["Valor"].sum()
-    total_iva_incluido = df["Total"].sum()
-
     df["Valor"] = df["Valor"].map(lambda x: f"{x:.2f}")
     df["Multiplicador"] = df["Multiplicador"].map(lambda x: f"{x:.2f}")
     df["Total"] = df["Total"].map(lambda x: f"{x:.2f}")
@@ -480,3 +681,22 @@ with tab6:
         st.metric("💰 Total IVA incluido", f"{total_iva_incluido:,.2f}")
 
 
+# -------------------------------------------------------------
+# DIAGNÓSTICO
+# -------------------------------------------------------------
+with st.sidebar.expander("🐞 Diagnóstico"):
+    st.caption("Tiempos de esta ejecución")
+    st.dataframe(pd.DataFrame(telemetria.stages), use_container_width=True, hide_index=True)
+    if telemetria.solves:
+        st.caption("Motores de corte por código")
+        st.dataframe(
+            pd.DataFrame([{"codigo": k, **v} for k, v in telemetria.solves.items()]).drop(columns="remnant_pass", errors="ignore"),
+            use_container_width=True,
+            hide_index=True,
+        )
+    dump_dir = os.environ.get("CPSAT_DUMP_DIR")
+    st.caption(
+        f"Modelos CP-SAT de más de {os.environ.get('CPSAT_DUMP_SECONDS', 10)} s guardados en {dump_dir}"
+        if dump_dir else
+        "Para guardar los modelos CP-SAT lentos, iniciar la app con CPSAT_DUMP_DIR=<carpeta>."
+    )
@@ -0,0 +1,171 @@
+"""
+Batch cutting of several confirmed orders, without Streamlit.
+
+Takes the basket.json files exported from the sidebar ("Descargar
+productos"), combines their profile BOMs, solves each code across all
+orders so they share bars, and writes the cut list as CSV and/or PDF.
+Every cut is tagged with the order (file name) and product it belongs to.
+
+    python batch.py pedidos/*.json --salida cortes/ --formato pdf csv
+"""
+import argparse
+import json
+from pathlib import Path
+
+import pandas as pd
+
+from catalog import build_bom_basket, get_product_by_name, load_catalog_cached
+from cutting_stock import as_demand, solve_codes
+from pdf import generate_pdf
+from solution_cache import SolutionCache
+from stock import StockIndex, stock_from_yaml
+
+BARRA_NUEVA = "Barra nueva"
+
+
+def load_orders(paths):
+    """{order name: basket items} from exported basket.json files."""
+    orders = {}
+    for path in map(Path, paths):
+        with open(path, "r", encoding="utf-8") as f:
+            orders[path.stem] = json.load(f)
+    return orders
+
+
+def build_demand(orders, products, parts):
+    """
+    Combined cut demand per code (products: list or {tipología: product}).
+
+    Returns (jobs, tags): jobs as expected by solve_codes, and for each
+    code and length the list of (order, product) tags, one per unit.
+    """
+    items = []
+    item_orders = []
+    for order, basket in orders.items():
+        for item in basket:
+            if get_product_by_name(item["product_name"], products) is None:
+                raise ValueError(f"{order}: no existe la tipología '{item['product_name']}'.")
+            items.append(item)
+            item_orders.append(order)
+
+    df_perfiles, _, _ = build_bom_basket(items, products, parts)
+
+    tags = {}
+    for k, codigo, medida, cantidad in df_perfiles[["item", "codigo", "medida_calculada", "cantidad"]].itertuples(index=False):
+        by_length = tags.setdefault(codigo, {})
+        by_length.setdefault(medida, []).extend([(item_orders[k], items[k]["description"])] * int(cantidad))
+
+    jobs = {
+        code: {
+            "stock_length": parts[code]["largo"],
+            "pieces": as_demand({length: len(t) for length, t in by_length.items()}),
+        }
+        for code, by_length in tags.items()
+    }
+    return jobs, tags
+
+
+def tag_cuts(bars, tags):
+    """Pair every cut of bars with one (order, product) tag of its length."""
+    queues = {length: list(t) for length, t in tags.items()}
+    return [[(cut, *queues[cut].pop()) for cut in bar] for bar in bars]
+
+
+def cut_rows(results, tags, parts):
+    """One row per cut, ready for CSV."""
+    rows = []
+    for code, (bars, leftovers, origins) in sorted(results.items()):
+        for i, bar in enumerate(tag_cuts(bars, tags[code])):
+            origin = origins[i] if origins else None
+            for cut, order, product in bar:
+                rows.append({
+                    "Código": code,
+                    "Descripción": parts[code]["descripcion"],
+                    "Barra #": i + 1,
+                    "Origen": BARRA_NUEVA if origin is None else f"{origin['posicion']} ({origin['largo']} mm)",
+                    "Corte (mm)": cut,
+                    "Pedido": order,
+                    "Producto": product,
+                    "Sobrante (mm)": leftovers[i],
+                })
+    return pd.DataFrame(rows)
+
+
+def pdf_rows(df_cuts):
+    """Bar-level table for generate_pdf, with the tag next to each cut."""
+    df = df_cuts.assign(Corte=lambda d: d.apply(
+        lambda r: f"{r['Corte (mm)']} ({r['Pedido']} / {r['Producto']})", axis=1
+    ))
+    return (
+        df.groupby(["Código", "Barra #", "Origen"], sort=True)["Corte"]
+        .agg(", ".join)
+        .rename("Cortes")
+        .reset_index()
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cálculo de cortes de varios pedidos a la vez.")
+    parser.add_argument("pedidos", nargs="+", help="Archivos basket.json exportados desde la app.")
+    parser.add_argument("--salida", default="cortes", help="Carpeta de salida (default: cortes).")
+    parser.add_argument("--formato", nargs="+", choices=["pdf", "csv"], default=["pdf", "csv"])
+    parser.add_argument("--motor", choices=["cp-sat", "column-generation", "heuristic"], default="cp-sat")
+    parser.add_argument("--kerf", type=float, default=5, help="Ancho de la hoja de corte (mm).")
+    parser.add_argument("--descarte", type=float, default=50, help="Descarte de punta por lado (mm).")
+    parser.add_argument("--sobrante", type=float, default=500, help="Sobrante reutilizable mínimo (mm), 0 = desactivado.")
+    parser.add_argument("--stock", help="Usar primero las barras de este archivo de stock (formato stock_aluminio.yaml).")
+    parser.add_argument("--procesos", type=int, help="Códigos que se calculan a la vez.")
+    parser.add_argument("--nucleos", type=int, help="Núcleos totales a repartir.")
+    parser.add_argument("--catalogo", default=".", help="Carpeta con parts.yaml y product_*.yaml.")
+    parser.add_argument("--sin-cache", action="store_true", help="No usar la caché de soluciones.")
+    args = parser.parse_args(argv)
+
+    catalog = load_catalog_cached(args.catalogo)
+    parts = catalog.parts
+
+    orders = load_orders(args.pedidos)
+    jobs, tags = build_demand(orders, catalog.by_name, parts)
+
+    for code, job in jobs.items():
+        too_long = [l for l, _ in job["pieces"] if l > job["stock_length"]]
+        if too_long:
+            parser.error(f"código {code}: piezas mayores al largo de la barra ({too_long}).")
+
+    if args.stock:
+        with open(args.stock, "r", encoding="utf-8") as f:
+            stock_index = StockIndex(stock_from_yaml(f.read()))
+        for code, job in jobs.items():
+            shortest = min(l for l, _ in job["pieces"])
+            job["remnants"] = stock_index.at_least(code, shortest + 2 * args.descarte)
+
+    results = {}
+    for code, bars, leftovers, origins in solve_codes(
+        jobs,
+        engine=args.motor,
+        kerf=args.kerf,
+        edge_trim=args.descarte,
+        max_workers=args.procesos,
+        cpu_budget=args.nucleos,
+        cache=None if args.sin_cache else SolutionCache(),
+        min_remnant=args.sobrante or None,
+    ):
+        if bars is None:
+            raise SystemExit(f"código {code}: no se encontró un plan de cortes.")
+        results[code] = (bars, leftovers, origins)
+        new_bars = sum(o is None for o in origins) if origins else len(bars)
+        print(f"{code} - {parts[code]['descripcion']}: {len(bars)} barras ({new_bars} nuevas)")
+
+    out = Path(args.salida)
+    out.mkdir(parents=True, exist_ok=True)
+    df_cuts = cut_rows(results, tags, parts)
+
+    if "csv" in args.formato:
+        df_cuts.to_csv(out / "lista_de_cortes.csv", index=False)
+    if "pdf" in args.formato:
+        buffer = generate_pdf(df_cuts_flat=pdf_rows(df_cuts), parts=parts)
+        (out / "lista_de_cortes.pdf").write_bytes(buffer.getvalue())
+    print(f"{len(orders)} pedidos, {len(df_cuts)} cortes -> {out}/")
+
+
+if __name__ == "__main__":
+    main()
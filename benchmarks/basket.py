@@ -0,0 +1,55 @@
+"""
+Seeded generator of realistic baskets from the product catalog.
+
+Items have the same shape as the ones the app stores in the basket (and
+exports as basket.json), so they feed build_bom_basket, batch.py or the app.
+"""
+import random
+
+# typical openings (mm); orders are usually measured to the centimetre
+ANCHO = (400, 3000)
+ALTO = (400, 2500)
+CANTIDAD = [1] * 6 + [2] * 3 + [3, 4, 6]
+
+
+def random_item(product, rng, k=0):
+    """One basket item of product with random size, quantity and options."""
+    return {
+        "description": f"item {k + 1}",
+        "ancho": rng.randrange(ANCHO[0], ANCHO[1] + 1, 10),
+        "alto": rng.randrange(ALTO[0], ALTO[1] + 1, 10),
+        "cantidad": rng.choice(CANTIDAD),
+        "product_name": product["tipologia"],
+        "selection": {sel["nombre"]: rng.choice(sel["opciones"]) for sel in product["selecciones"]},
+    }
+
+
+def random_basket(products, n_items, seed=0):
+    """n_items random items over products (a list of loaded products)."""
+    rng = random.Random(seed)
+    return [random_item(rng.choice(products), rng, k) for k in range(n_items)]
+
+
+def cuts_of_code(products, parts, codigo, n_cuts, seed=0):
+    """
+    Exactly n_cuts pieces of one profile code, as (length, count) pairs,
+    taken from random baskets so the length mix is the catalog's own.
+    """
+    from catalog import build_bom_basket
+
+    rng = random.Random(seed)
+    cuts = []
+    k = 0
+    while len(cuts) < n_cuts:
+        items = [random_item(rng.choice(products), rng, k + i) for i in range(50)]
+        k += len(items)
+        df_perfiles, _, _ = build_bom_basket(items, products, parts)
+        rows = df_perfiles[df_perfiles["codigo"] == codigo]
+        for medida, cantidad in rows[["medida_calculada", "cantidad"]].itertuples(index=False):
+            cuts.extend([float(medida)] * int(cantidad))
+        if k > 50 * n_cuts:
+            raise ValueError(f"el código {codigo} no aparece en el catálogo de productos")
+    counts = {}
+    for length in cuts[:n_cuts]:
+        counts[length] = counts.get(length, 0) + 1
+    return sorted(counts.items(), reverse=True)
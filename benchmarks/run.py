@@ -0,0 +1,214 @@
+"""
+End-to-end benchmark of the quoting pipeline.
+
+Times each stage on seeded synthetic orders (benchmarks/basket.py) and
+writes the results as JSON, so speed and cut quality can be compared
+between commits on the same machine:
+
+    python -m benchmarks.run
+    python -m benchmarks.run --cortes 10 100 --motores heuristic --salida /tmp/b.json
+
+Stages: catalog load (cold and snapshot), BOM building per item and for the
+whole basket, each cutting engine at several cuts per code (wall time, bars,
+waste and gap to the lower bound) and the cut-list PDF.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+import catalog as catalog_module
+from benchmarks.basket import cuts_of_code, random_basket
+from catalog import (
+    build_bom_accesorios, build_bom_basket, build_bom_perfiles, get_product_by_name,
+    load_catalog, load_catalog_cached,
+)
+from cutting_stock import (
+    cutting_stock_column_generation, cutting_stock_heuristic, cutting_stock_with_kerf, lower_bound,
+)
+from pdf import generate_pdf
+
+RESULTS_DIR = Path(__file__).parent / "resultados"
+
+
+def timed(fn, repeat=1):
+    """(best wall time in seconds over repeat runs, result of the last run)."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return round(best, 6), result
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def bench_catalog(directory, repeat):
+    directory = Path(directory)
+    product_paths = sorted(directory.glob("product_*.yaml"))
+    cold, _ = timed(lambda: load_catalog(directory / "parts.yaml", product_paths), repeat)
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = Path(tmp) / "catalogo.pickle"
+        first, catalog = timed(lambda: load_catalog_cached(directory, snapshot))
+
+        def from_snapshot():
+            # Drop the in-memory copy so the pickle file is actually read.
+            catalog_module._snapshot = None
+            return load_catalog_cached(directory, snapshot)
+
+        warm, _ = timed(from_snapshot, repeat)
+    return {"sin_cache_s": cold, "snapshot_primera_s": first, "snapshot_s": warm}, catalog
+
+
+def bench_bom(catalog, sizes, seed, repeat):
+    results = []
+    for n_items in sizes:
+        items = random_basket(catalog.products, n_items, seed)
+
+        def per_item():
+            for item in items:
+                product = get_product_by_name(item["product_name"], catalog.by_name)
+                build_bom_perfiles(item["selection"], product, catalog.parts, item["ancho"], item["alto"])
+                build_bom_accesorios(item["selection"], product, catalog.parts)
+
+        t_items, _ = timed(per_item, repeat)
+        t_basket, (df_perfiles, _, _) = timed(lambda: build_bom_basket(items, catalog.by_name, catalog.parts), repeat)
+        results.append({
+            "items": n_items,
+            "por_item_s": t_items,
+            "canasta_s": t_basket,
+            "cortes": int(df_perfiles["cantidad"].sum()),
+        })
+    return results
+
+
+def bench_solvers(catalog, codigo, sizes, engines, kerf, edge_trim, max_cpsat, num_workers, seed):
+    stock_length = catalog.parts[codigo]["largo"]
+    solvers = {
+        "cp-sat": lambda p, s: cutting_stock_with_kerf(stock_length, p, kerf, edge_trim, num_workers=num_workers, stats=s),
+        "column-generation": lambda p, s: cutting_stock_column_generation(
+            stock_length, p, kerf, edge_trim, num_workers=num_workers, stats=s
+        ),
+        "heuristic": lambda p, s: cutting_stock_heuristic(stock_length, p, kerf, edge_trim, stats=s),
+    }
+    results = []
+    plans = {}
+    for n_cuts in sizes:
+        pieces = cuts_of_code(catalog.products, catalog.parts, codigo, n_cuts, seed)
+        bound = lower_bound(stock_length, pieces, kerf, edge_trim)
+        for engine in engines:
+            row = {"motor": engine, "cortes": n_cuts, "largos_distintos": len(pieces), "cota_inferior": bound}
+            if engine == "cp-sat" and max_cpsat is not None and n_cuts > max_cpsat:
+                results.append({**row, "omitido": f"más de {max_cpsat} cortes"})
+                continue
+            stats = {}
+            wall, (bars, leftovers) = timed(lambda: solvers[engine](pieces, stats))
+            if bars is None:
+                results.append({**row, "tiempo_s": wall, "barras": None, "estado": stats.get("status")})
+                continue
+            results.append({
+                **row,
+                "tiempo_s": wall,
+                "estado": stats.get("status"),
+                "barras": len(bars),
+                "desperdicio_mm": round(sum(leftovers), 2),
+                "brecha": len(bars) - bound,
+                "brecha_pct": round(100 * (len(bars) - bound) / bound, 2) if bound else 0.0,
+            })
+            plans[n_cuts] = bars
+        print(f"  {n_cuts} cortes: " + ", ".join(
+            f"{r['motor']} {r.get('barras', '-')} barras {r.get('tiempo_s', '-')} s"
+            for r in results if r["cortes"] == n_cuts
+        ))
+    return results, plans
+
+
+def bench_pdf(catalog, codigo, plans, repeat):
+    results = []
+    for n_cuts, bars in sorted(plans.items()):
+        df = pd.DataFrame([
+            {"Código": codigo, "Barra #": i + 1, "Origen": "Barra nueva", "Cortes": ", ".join(f"{c:g}" for c in bar)}
+            for i, bar in enumerate(bars)
+        ])
+        wall, buffer = timed(lambda: generate_pdf(df, catalog.parts), repeat)
+        results.append({"cortes": n_cuts, "barras": len(bars), "tiempo_s": wall, "bytes": len(buffer.getvalue())})
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de punta a punta de cotización y cortes.")
+    parser.add_argument("--catalogo", default=".", help="Carpeta con parts.yaml y product_*.yaml.")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--items", type=int, nargs="+", default=[10, 100, 1000], help="Tamaños de canasta.")
+    parser.add_argument("--cortes", type=int, nargs="+", default=[10, 100, 1000, 5000], help="Cortes por código.")
+    parser.add_argument("--motores", nargs="+", choices=["cp-sat", "column-generation", "heuristic"],
+                        default=["cp-sat", "column-generation", "heuristic"])
+    parser.add_argument("--codigo", type=int, help="Código de perfil a cortar (default: el más usado).")
+    parser.add_argument("--max-cortes-cpsat", type=int,
+                        help="Por encima de esta cantidad de cortes no se corre CP-SAT (default: sin límite).")
+    parser.add_argument("--kerf", type=float, default=5)
+    parser.add_argument("--descarte", type=float, default=50)
+    parser.add_argument("--nucleos", type=int, help="Núcleos para los motores que los usan.")
+    parser.add_argument("--repeticiones", type=int, default=3, help="Se toma el mejor tiempo de las etapas rápidas.")
+    parser.add_argument("--salida", help="Archivo JSON (default: benchmarks/resultados/<commit>.json).")
+    args = parser.parse_args(argv)
+
+    env = environment()
+    print(f"commit {env['commit']} - {env['cpus']} cpus")
+
+    print("catálogo...")
+    t_catalog, catalog = bench_catalog(args.catalogo, args.repeticiones)
+
+    print("listas de materiales...")
+    t_bom = bench_bom(catalog, args.items, args.semilla, args.repeticiones)
+
+    codigo = args.codigo
+    if codigo is None:
+        _, _, demanda = build_bom_basket(random_basket(catalog.products, 100, args.semilla), catalog.by_name, catalog.parts)
+        codigo = max(demanda, key=lambda c: sum(n for _, n in demanda[c]))
+    print(f"motores de corte (código {codigo})...")
+    t_solvers, plans = bench_solvers(
+        catalog, codigo, args.cortes, args.motores, args.kerf, args.descarte,
+        args.max_cortes_cpsat, args.nucleos, args.semilla,
+    )
+
+    print("pdf...")
+    t_pdf = bench_pdf(catalog, codigo, plans, args.repeticiones)
+
+    results = {
+        "entorno": env,
+        "parametros": {**vars(args), "codigo": codigo},
+        "catalogo": t_catalog,
+        "bom": t_bom,
+        "cortes": t_solvers,
+        "pdf": t_pdf,
+    }
+    out = Path(args.salida) if args.salida else RESULTS_DIR / f"{env['commit'] or 'sin-commit'}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"-> {out}")
+
+
+if __name__ == "__main__":
+    main()
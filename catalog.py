@@ -0,0 +1,487 @@
+"""
+Product catalog and bills of materials.
+
+Product YAMLs are validated and their rules compiled once, then kept in a
+pickled snapshot keyed on the source files, so a restart loads the whole
+catalog without parsing YAML again.
+"""
+import ast
+import functools
+import hashlib
+import os
+import pickle
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from parts_store import PARTS_DB, PartsStore
+from stock import YamlLoader
+
+SNAPSHOT_FILE = ".cache/catalogo.pickle"
+SNAPSHOT_VERSION = 1  # bump when CompiledProduct/Catalog change shape
+
+
+class CatalogError(ValueError):
+    """The product catalog is inconsistent (bad measure, unknown part...)."""
+
+
+class CompiledProduct(dict):
+    """
+    A product as loaded from its YAML, plus what is compiled once at load
+    time: the rule decision table and, when parts are given, the fixed BOM
+    lines with their part attributes resolved.
+    """
+    rule_table = None
+    fixed_lines = None
+
+
+class Catalog:
+    """Parts plus compiled products, indexed by tipología."""
+
+    def __init__(self, parts, products):
+        self.parts = parts
+        self.products = products
+        self.by_name = {p["tipologia"]: p for p in products}
+
+    def product(self, name):
+        return self.by_name.get(name)
+
+
+def get_product_by_name(name: str, products):
+    """products is a list of products or a {tipología: product} index."""
+    if isinstance(products, dict):
+        return products.get(name)
+    for p in products:
+        if p["tipologia"] == name:
+            return p
+    return None
+
+def load_parts(filepath: str):
+    """Load parts.yaml into a dict with int codes as keys."""
+    with open(filepath, "r", encoding="utf-8") as f:
+        parts = yaml.load(f, Loader=YamlLoader)
+    return {k: v for k, v in parts.items()}
+
+def open_parts(filepath):
+    """Parts from parts.yaml, or a lazily read PartsStore for a .sqlite file."""
+    if Path(filepath).suffix in (".sqlite", ".db"):
+        return PartsStore(filepath)
+    return load_parts(filepath)
+
+def load_product(filepath: str, parts=None):
+    """
+    Load a product YAML (keeps codes as ints) into a CompiledProduct.
+
+    Measures are validated and rules compiled into a decision table; with
+    parts, every referenced code must exist and fixed lines are resolved.
+    """
+    with open(filepath, "r", encoding="utf-8") as f:
+        product = CompiledProduct(yaml.load(f, Loader=YamlLoader))
+
+    for sel in product.get("selecciones", []):
+        sel["opciones"] = [c for c in sel["opciones"]]
+
+    for item in product.get("items_fijos", []):
+        item["codigo"] = item["codigo"]
+
+    validate_product(product)
+    product.rule_table = compile_rules(product)
+    if parts is not None:
+        codes = [item["codigo"] for item in product.get("items_fijos", [])]
+        codes += [c for sel in product.get("selecciones", []) for c in sel["opciones"]]
+        # A PartsStore fetches every code in one query instead of one per lookup
+        found = parts.load(codes) if isinstance(parts, PartsStore) else parts
+        missing = sorted({c for c in codes if c not in found})
+        if missing:
+            raise CatalogError(f"{product.get('tipologia', filepath)}: códigos inexistentes en la lista de piezas {missing}")
+        product.fixed_lines = {tipo: _fixed_lines(product, parts, tipo) for tipo in ("perfil", "accesorio")}
+    return product
+
+
+def load_catalog(parts_path, product_paths):
+    """Load parts (YAML or SQLite store) and every product YAML into a Catalog."""
+    parts = open_parts(parts_path)
+    return Catalog(parts, [load_product(pf, parts) for pf in product_paths])
+
+
+_snapshot_lock = threading.Lock()
+_snapshot = None  # in-memory copy, shared by every session of the server
+
+
+def _file_state(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def _file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def load_catalog_cached(directory=".", snapshot_path=SNAPSHOT_FILE):
+    """
+    Catalog of directory (parts.yaml + product_*.yaml), compiled once.
+    A parts.sqlite store in directory takes precedence over parts.yaml.
+
+    The compiled catalog is kept in memory for all sessions and pickled to
+    snapshot_path so restarts skip YAML parsing too. Each call only stats
+    the source files: a file is re-read when its mtime or size changed and
+    re-parsed only if its content hash changed as well. A changed parts.yaml
+    recompiles every product; otherwise only the changed product files are
+    reloaded.
+    """
+    global _snapshot
+    directory = Path(directory)
+    parts_path = directory / PARTS_DB
+    if not parts_path.exists():
+        parts_path = directory / "parts.yaml"
+    product_paths = sorted(directory.glob("product_*.yaml"))
+
+    with _snapshot_lock:
+        snap = _snapshot
+        if snap is None:
+            snap = _read_snapshot(snapshot_path)
+
+        old_parts = snap["parts"]
+        parts_entry = _refresh_entry(old_parts, parts_path, open_parts)
+        old_products = snap["products"]
+        if old_parts is None or parts_entry[1] != old_parts[1]:
+            old_products = {}  # parts changed: resolve every product again
+        parts = parts_entry[2]
+
+        products = {
+            str(pf): _refresh_entry(old_products.get(str(pf)), pf, lambda p: load_product(p, parts))
+            for pf in product_paths
+        }
+        same_content = (
+            old_parts is not None
+            and parts is old_parts[2]
+            and products.keys() == old_products.keys()
+            and all(products[k][2] is old_products[k][2] for k in products)
+        )
+        same_state = parts_entry is old_parts and all(products[k] is old_products[k] for k in products)
+        catalog = snap["catalog"] if same_content else Catalog(parts, [entry[2] for entry in products.values()])
+
+        snap = {"version": SNAPSHOT_VERSION, "parts": parts_entry, "products": products, "catalog": catalog}
+        if not (same_content and same_state):
+            _write_snapshot(snapshot_path, snap)
+        _snapshot = snap
+        return catalog
+
+
+def _refresh_entry(entry, path, load):
+    """(file state, content hash, loaded value) for path, reusing entry if unchanged."""
+    state = _file_state(path)
+    if entry is not None and entry[0] == state:
+        return entry
+    digest = _file_hash(path)
+    if entry is not None and entry[1] == digest:
+        return (state, digest, entry[2])
+    return (state, digest, load(path))
+
+
+def _read_snapshot(snapshot_path):
+    try:
+        with open(snapshot_path, "rb") as f:
+            snap = pickle.load(f)
+        if snap.get("version") == SNAPSHOT_VERSION:
+            return snap
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        pass
+    return {"version": SNAPSHOT_VERSION, "parts": None, "products": {}}
+
+
+def _write_snapshot(snapshot_path, snap):
+    snapshot_path = Path(snapshot_path)
+    snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = snapshot_path.with_suffix(".tmp")
+    with open(tmp, "wb") as f:
+        pickle.dump(snap, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, snapshot_path)
+
+def get_available_decisions(product, user_selection):
+    return {sel["nombre"]: sel["opciones"][:] for sel in product["selecciones"]}
+
+class MeasureError(CatalogError):
+    """A measure expression is not valid arithmetic over A and H."""
+
+
+_MEASURE_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant, ast.Name, ast.Load,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.UAdd, ast.USub,
+)
+_MEASURE_NAMES = {"A", "H"}
+
+
+@functools.lru_cache(maxsize=None)
+def compile_medida(medida):
+    """
+    Parse a measure (number or expression such as "A/2-23") once and return
+    a function f(A, H). The AST only allows numbers, A, H, + - * / and
+    parentheses; anything else raises MeasureError. f works on scalars and
+    on NumPy arrays of A and H alike.
+    """
+    if isinstance(medida, (int, float)) and not isinstance(medida, bool):
+        return lambda A, H: medida + 0 * A
+
+    try:
+        tree = ast.parse(str(medida).strip(), mode="eval")
+    except SyntaxError as e:
+        raise MeasureError(f"Medida inválida '{medida}': {e.msg}") from None
+
+    for node in ast.walk(tree):
+        if not isinstance(node, _MEASURE_NODES):
+            raise MeasureError(f"Medida inválida '{medida}': solo se permiten números, A, H y + - * /")
+        if isinstance(node, ast.Name) and node.id not in _MEASURE_NAMES:
+            raise MeasureError(f"Medida inválida '{medida}': variable desconocida '{node.id}'")
+        if isinstance(node, ast.Constant) and (isinstance(node.value, bool) or not isinstance(node.value, (int, float))):
+            raise MeasureError(f"Medida inválida '{medida}': constante no numérica {node.value!r}")
+
+    code = compile(tree, f"<medida {medida}>", "eval")
+    return lambda A, H: eval(code, {"__builtins__": {}}, {"A": A, "H": H})
+
+
+def calcular_medida(medida, A: int, H: int) -> float:
+    return compile_medida(medida)(A, H)
+
+
+def calcular_medidas(medida, A, H):
+    """Vectorized calcular_medida over arrays of A and H (one call per order)."""
+    A = np.asarray(A)
+    return np.array(np.broadcast_to(compile_medida(medida)(A, np.asarray(H)), A.shape))
+
+
+def validate_product(product):
+    """
+    Compile every measure of a product (fixed items, selections and rule
+    actions) so invalid expressions fail when the catalog loads.
+    """
+    name = product.get("tipologia", "?")
+    medidas = [(f"item fijo {item['codigo']}", item["medida"]) for item in product.get("items_fijos", []) if "medida" in item]
+    medidas += [(sel["nombre"], sel["medida"]) for sel in product.get("selecciones", []) if sel.get("medida") is not None]
+    for rule in product.get("rules", []):
+        for action in rule.get("actions", []):
+            if action.get("type") == "update_measure":
+                medidas.append((f"regla para {action['target']}", action["value"]))
+
+    for where, medida in medidas:
+        try:
+            compile_medida(medida)
+        except MeasureError as e:
+            raise MeasureError(f"{name} ({where}): {e}") from None
+
+def compile_rules(product):
+    """
+    Decision table for a product's rules.
+
+    Rules are grouped by the selection names their condition looks at; each
+    group maps the tuple of required values to [(rule index, measures)].
+    Matching a selection is then one lookup per group, not a scan of every
+    rule and condition.
+    """
+    table = {}
+    for index, rule in enumerate(product.get("rules", [])):
+        condition = rule.get("condition", {}).get("selection", {})
+        names = tuple(sorted(condition))
+        values = tuple(str(condition[k]) for k in names)
+        measures = [
+            (action["target"], action["value"])
+            for action in rule.get("actions", [])
+            if action.get("type") == "update_measure"
+        ]
+        table.setdefault(names, {}).setdefault(values, []).append((index, measures))
+    return table
+
+
+def apply_rules(product, user_selection) -> dict:
+    if getattr(product, "rule_table", None) is not None:
+        matches = []
+        for names, decisions in product.rule_table.items():
+            matches += decisions.get(tuple(str(user_selection.get(k)) for k in names), [])
+        # later rules win, as in the YAML order
+        result = {}
+        for _, measures in sorted(matches, key=lambda m: m[0]):
+            result.update(measures)
+        return result
+
+    rules = product.get("rules", [])
+    result = {}
+
+    for rule in rules:
+        condition = rule.get("condition", {}).get("selection", {})
+        if all(str(user_selection.get(k)) == str(v) for k, v in condition.items()):
+            for action in rule.get("actions", []):
+                if action.get("type") == "update_measure":
+                    result[action["target"]] = action["value"]
+
+    return result
+
+
+def _fixed_lines(product, parts, tipo):
+    """BOM lines of the fixed items of one part type, for one unit."""
+    bom = []
+    for item in product.get("items_fijos", []):
+        part = parts[item["codigo"]]
+        if part["tipo"] != tipo:
+            continue
+        if tipo == "perfil":
+            bom.append({
+                "codigo": item["codigo"],
+                "descripcion": part["descripcion"],
+                "especificacion_medida": item["medida"],
+                "cantidad": item["cantidad"],
+            })
+        else:
+            bom.append({
+                "codigo": item["codigo"],
+                "descripcion": part["descripcion"],
+                "precio unidad": part["precio"],
+                "cantidad": item["cantidad"],
+                "precio total": part["precio"] * item["cantidad"]
+            })
+    return bom
+
+
+def _fixed_bom(product, parts, tipo):
+    if getattr(product, "fixed_lines", None) is not None:
+        return [dict(row) for row in product.fixed_lines[tipo]]
+    return _fixed_lines(product, parts, tipo)
+
+
+def _bom_perfiles_lines(user_selection, product, parts):
+    """Profile BOM lines for one unit, with the measure still unevaluated."""
+    measures = {sel["nombre"]: sel.get("medida") for sel in product["selecciones"]}
+    medidas_por_reglas = apply_rules(product, user_selection)
+
+    # Fixed items
+    bom = _fixed_bom(product, parts, "perfil")
+
+    # User selections
+    for sel in product.get("selecciones", []):
+        if sel["nombre"] in user_selection:
+            codigo = int(user_selection[sel["nombre"]])
+            if parts[codigo]["tipo"] == "perfil":
+                especificacion_medida = measures.get(sel["nombre"], sel.get("medida"))
+                if especificacion_medida is None:
+                    especificacion_medida = medidas_por_reglas[sel["nombre"]]
+                bom.append({
+                    "codigo": codigo,
+                    "descripcion": parts[codigo]["descripcion"],
+                    "especificacion_medida": especificacion_medida,
+                    "cantidad": sel["cantidad"],
+                })
+
+    return bom
+
+
+def build_bom_perfiles(user_selection, product, parts, ancho, alto):
+    bom = _bom_perfiles_lines(user_selection, product, parts)
+    for row in bom:
+        row["medida_calculada"] = calcular_medida(row["especificacion_medida"], ancho, alto)
+    return bom
+
+
+def build_bom_accesorios(user_selection, product, parts):
+    # Fixed items
+    bom = _fixed_bom(product, parts, "accesorio")
+
+    # User selections
+    for sel in product.get("selecciones", []):
+        if sel["nombre"] in user_selection:
+            codigo = int(user_selection[sel["nombre"]])
+            if parts[codigo]["tipo"] == "accesorio":
+                bom.append({
+                    "codigo": codigo,
+                    "descripcion": parts[codigo]["descripcion"],
+                    "precio unidad": parts[codigo]["precio"],
+                    "cantidad": sel["cantidad"],
+                    "precio total": parts[codigo]["precio"]*sel["cantidad"]
+                })
+    return bom
+
+
+PERFILES_COLUMNS = ["item", "producto", "codigo", "descripcion", "especificacion_medida", "medida_calculada", "cantidad"]
+ACCESORIOS_COLUMNS = ["item", "producto", "codigo", "descripcion", "cantidad", "precio unidad", "precio total"]
+
+
+def build_bom_basket(items, products, parts):
+    """
+    Profile and accessory BOMs of a whole selection of basket items
+    (products: list or {tipología: product} index).
+
+    Items sharing product and selection are built once: their BOM lines are
+    resolved a single time, measures are evaluated over the arrays of
+    (ancho, alto) and quantities multiplied in one vectorized step. Rows keep
+    the item order; "item" is the position of the row's item in items.
+
+    Returns (df_perfiles, df_accesorios, demanda), where demanda maps each
+    profile code to its (length, count) cut demand, longest first.
+    """
+    by_name = products if isinstance(products, dict) else {p["tipologia"]: p for p in products}
+    groups = {}
+    for k, item in enumerate(items):
+        key = (item["product_name"], tuple(sorted(item["selection"].items())))
+        groups.setdefault(key, []).append(k)
+
+    perfiles = {c: [] for c in PERFILES_COLUMNS}
+    perfiles["linea"] = []
+    accesorios = {c: [] for c in ACCESORIOS_COLUMNS}
+    accesorios["linea"] = []
+
+    for (name, _), idxs in groups.items():
+        product = by_name[name]
+        selection = items[idxs[0]]["selection"]
+        idxs = np.array(idxs)
+        A = np.array([items[k]["ancho"] for k in idxs])
+        H = np.array([items[k]["alto"] for k in idxs])
+        unidades = np.array([items[k]["cantidad"] for k in idxs])
+        productos = [items[k]["description"] for k in idxs]
+
+        for linea, row in enumerate(_bom_perfiles_lines(selection, product, parts)):
+            perfiles["item"].append(idxs)
+            perfiles["linea"].append(np.full(len(idxs), linea))
+            perfiles["producto"].append(productos)
+            perfiles["codigo"].append(np.full(len(idxs), row["codigo"]))
+            perfiles["descripcion"].append([row["descripcion"]] * len(idxs))
+            perfiles["especificacion_medida"].append([row["especificacion_medida"]] * len(idxs))
+            perfiles["medida_calculada"].append(calcular_medidas(row["especificacion_medida"], A, H))
+            perfiles["cantidad"].append(row["cantidad"] * unidades)
+
+        for linea, row in enumerate(build_bom_accesorios(selection, product, parts)):
+            accesorios["item"].append(idxs)
+            accesorios["linea"].append(np.full(len(idxs), linea))
+            accesorios["producto"].append(productos)
+            accesorios["codigo"].append(np.full(len(idxs), row["codigo"]))
+            accesorios["descripcion"].append([row["descripcion"]] * len(idxs))
+            accesorios["cantidad"].append(row["cantidad"] * unidades)
+            accesorios["precio unidad"].append(np.full(len(idxs), row["precio unidad"]))
+            accesorios["precio total"].append(row["precio total"] * unidades)
+
+    df_perfiles = _columns_to_frame(perfiles, PERFILES_COLUMNS)
+    df_accesorios = _columns_to_frame(accesorios, ACCESORIOS_COLUMNS)
+
+    demanda = {}
+    if not df_perfiles.empty:
+        totales = df_perfiles.groupby(["codigo", "medida_calculada"], sort=False)["cantidad"].sum()
+        for (codigo, medida), cantidad in totales.items():
+            demanda.setdefault(codigo, []).append((medida, int(cantidad)))
+        for codigo in demanda:
+            demanda[codigo].sort(key=lambda lc: lc[0], reverse=True)
+
+    return df_perfiles, df_accesorios, demanda
+
+
+def _columns_to_frame(columns, order):
+    """Concatenate per-line column chunks and sort rows by (item, line)."""
+    if not columns["item"]:
+        return pd.DataFrame(columns=order)
+    data = {}
+    for c, chunks in columns.items():
+        # text and mixed columns stay Python objects
+        dtype = object if c in ("producto", "descripcion", "especificacion_medida") else None
+        data[c] = np.concatenate([np.asarray(chunk, dtype=dtype) for chunk in chunks])
+    rows = np.lexsort((data.pop("linea"), data["item"]))
+    return pd.DataFrame({c: data[c][rows] for c in order})
@@ -0,0 +1,188 @@
+"""
+Cutting plans solved in the background.
+
+A CuttingJob solves every code of a cut demand on a daemon thread and keeps
+the best plan found so far for each one: a heuristic plan for every code
+within a second, then the improving solutions the chosen engine reports
+through its CP-SAT solution callback. The page polls snapshot() and
+cancels the job when its inputs change.
+
+A job built from the previous one is incremental: codes whose inputs did
+not change keep their plan without solving, and changed codes start from
+their previous plan repaired to the new demand, so editing one window of
+a large order re-solves only the codes it feeds.
+"""
+import atexit
+import hashlib
+import json
+import threading
+import weakref
+
+from cutting_stock import repair_plan, solve_codes
+
+# options that change the plans (the rest only change how fast they come)
+PLAN_OPTIONS = ("engine", "kerf", "edge_trim", "min_remnant", "seed")
+
+_running = weakref.WeakSet()
+
+
+@atexit.register
+def _cancel_running():
+    # a CP-SAT search still running when the interpreter exits aborts it
+    for job in list(_running):
+        job.cancel()
+    for job in list(_running):
+        job._thread.join(timeout=5)
+
+
+def inputs_key(jobs, **options):
+    """Hash of a cut demand and the options that change its plans."""
+    canonical = json.dumps({"jobs": jobs, "options": options}, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _rank(bars, origins, edge_trim=0):
+    """
+    Objective the engines minimize (lower is better): new bars bought, then
+    the length of stock remnants consumed, trim excluded, as in
+    cutting_stock_with_remnants. Without remnants it is the bar count.
+    """
+    origins = origins or [None] * len(bars)
+    return (
+        sum(o is None for o in origins),
+        sum(o["largo"] - 2 * edge_trim for o in origins if o is not None),
+    )
+
+
+class CuttingJob:
+    """
+    Background solve of jobs ({code: {"stock_length", "pieces", ...}}) with
+    solve_codes options (engine, kerf, edge_trim, cache...).
+
+    A plan only replaces the current one of its code when it is no worse,
+    so what snapshot() returns never regresses. cancel() ends the search;
+    every code then keeps its best plan so far.
+
+    previous is an earlier CuttingJob, usually the one being replaced (see
+    _carry_over). reused lists the codes taken from it unchanged; their
+    stats are carried over with status "REUSED" and the status of the solve
+    that made the plan under "previous_status".
+    """
+
+    def __init__(self, jobs, key=None, previous=None, **options):
+        self.jobs = jobs
+        self.key = key
+        self.options = options
+        self.stats = {}
+        self.error = None  # exception raised by the solve, if any
+        self._plans = {}  # code -> (bars, leftovers, origins)
+        self._final = set()  # codes whose solve ran to completion
+        self._revision = 0
+        self._finished = False
+        self._stop = threading.Event()
+        self._changed = threading.Condition()
+        self.reused = set()
+        self._warm = {}  # code -> bars of its previous plan, to start from
+        if previous is not None:
+            self._carry_over(previous)
+        self._thread = threading.Thread(target=self._run, name="cutting-job", daemon=True)
+        _running.add(self)
+        self._thread.start()
+
+    def _carry_over(self, previous):
+        """
+        Take the plans of previous for codes with the same job and plan
+        options whose solve ran to completion. Other codes it has a plan
+        for, including those cut short by cancel(), are solved again from
+        that plan, unless remnants are involved (their plans are not
+        repairable bar by bar).
+        """
+        _, plans, final = previous.snapshot()
+        same_options = all(previous.options.get(k) == self.options.get(k) for k in PLAN_OPTIONS)
+        for code, job in self.jobs.items():
+            plan = plans.get(code)
+            if plan is None:
+                continue
+            bars, _, origins = plan
+            completed = code in final and previous.stats.get(code, {}).get("status") != "CANCELLED"
+            if same_options and completed and previous.jobs.get(code) == job:
+                self._plans[code] = plan
+                self._final.add(code)
+                self.reused.add(code)
+                before = previous.stats.get(code, {})
+                self.stats[code] = {
+                    **before, "status": "REUSED", "previous_status": before.get("previous_status", before.get("status")),
+                }
+            elif not job.get("remnants") and not any(origins or []):
+                self._warm[code] = bars
+
+    def _update(self, code, bars, leftovers, origins, final=False):
+        with self._changed:
+            if bars is not None:
+                current = self._plans.get(code)
+                edge_trim = self.options.get("edge_trim", 0)
+                if current is None or _rank(bars, origins, edge_trim) <= _rank(current[0], current[2], edge_trim):
+                    self._plans[code] = (bars, leftovers, origins)
+                    self._revision += 1
+            if final:
+                self._final.add(code)
+            self._changed.notify_all()
+
+    def _run(self):
+        engine = self.options.get("engine", "cp-sat")
+        kerf = self.options.get("kerf", 0.0)
+        edge_trim = self.options.get("edge_trim", 0)
+        pending = {
+            code: {**job, "previous": self._warm[code]} if code in self._warm else job
+            for code, job in self.jobs.items()
+            if code not in self.reused
+        }
+        try:
+            # a usable plan for every code right away: the repaired previous
+            # plan, or the heuristic's
+            for code, job in pending.items():
+                if "previous" in job:
+                    bars, leftovers = repair_plan(job["previous"], job["pieces"], job["stock_length"], kerf, edge_trim)
+                    self._update(code, bars, leftovers, None if bars is None else [None] * len(bars))
+            if engine != "heuristic":
+                quick = {k: v for k, v in self.options.items() if k in ("kerf", "edge_trim", "min_remnant")}
+                fresh = {code: job for code, job in pending.items() if "previous" not in job}
+                for code, *plan in solve_codes(fresh, "heuristic", **quick):
+                    self._update(code, *plan)
+            if not self._stop.is_set():
+                for code, *plan in solve_codes(
+                    pending, stats=self.stats, on_solution=self._update, stop=self._stop, **self.options
+                ):
+                    # a search cut short by cancel() keeps its plan but is not
+                    # final: the next job solves that code again from it
+                    completed = plan[0] is not None and not self._stop.is_set()
+                    self._update(code, *plan, final=completed)
+        except Exception as e:  # reported by the page
+            self.error = e
+        finally:
+            with self._changed:
+                self._finished = True
+                self._changed.notify_all()
+
+    @property
+    def done(self):
+        return self._finished
+
+    @property
+    def cancelled(self):
+        return self._stop.is_set()
+
+    def cancel(self):
+        """Stop searching; running codes keep their best plan so far."""
+        self._stop.set()
+
+    def wait_for_plans(self, timeout=None):
+        """Block until every code has a plan or the job ends; True if all have one."""
+        with self._changed:
+            self._changed.wait_for(lambda: len(self._plans) == len(self.jobs) or self.done, timeout)
+            return len(self._plans) == len(self.jobs)
+
+    def snapshot(self):
+        """(revision, {code: (bars, leftovers, origins)}, codes solved to completion)."""
+        with self._changed:
+            return self._revision, dict(self._plans), set(self._final)
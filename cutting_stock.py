@@ -1,57 +1,1075 @@
-import pandas as pd
+import bisect
+import functools
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import numpy as np
+from ortools.linear_solver import pywraplp
 from ortools.sat.python import cp_model
 
-def cutting_stock_with_kerf(stock_length, pieces, kerf=0.0, edge_trim=0):
+import telemetry
+
+# Bump whenever an engine change alters the plans it returns (invalidates
+# cached solutions)
+SOLVER_VERSION = 8
+
+# CP-SAT time budget of the exact engine: grows with the model size
+# (distinct lengths x bars) between these, capped by CPSAT_MAX_SECONDS
+MIN_SECONDS = 2
+MAX_SECONDS = 60
+
+
+
+def as_demand(pieces):
+    """
+    Normalize a cut demand into (length, count) pairs, longest first.
+
+    Accepts pairs (or a {length: count} dict); equal lengths are merged.
+    """
+    if isinstance(pieces, dict):
+        pieces = pieces.items()
+    counts = {}
+    for length, count in pieces:
+        if count > 0:
+            counts[length] = counts.get(length, 0) + int(count)
+    return sorted(counts.items(), key=lambda lc: lc[0], reverse=True)
+
+
+def time_budget(n_lengths, n_bars):
+    """Seconds for a cutting model of n_lengths distinct lengths over n_bars bars."""
+    cap = float(os.environ.get("CPSAT_MAX_SECONDS", MAX_SECONDS))
+    return min(cap, max(MIN_SECONDS, n_lengths * n_bars / 100))
+
+
+def _configure(solver, time_limit, num_workers=None, seed=None):
+    """
+    Time limit, search workers and random seed of a CP-SAT solver. Workers
+    and seed default to CPSAT_WORKERS and CPSAT_SEED (CP-SAT's own defaults
+    when unset: all cores, seed 1).
+    """
+    solver.parameters.max_time_in_seconds = time_limit
+    num_workers = num_workers or int(os.environ.get("CPSAT_WORKERS") or 0)
+    if num_workers:
+        solver.parameters.num_workers = num_workers
+    if seed is None and os.environ.get("CPSAT_SEED"):
+        seed = int(os.environ["CPSAT_SEED"])
+    if seed is not None:
+        solver.parameters.random_seed = int(seed)
+
+
+def _record_solve(stats, solver, model, status, label):
+    """
+    Copy the numbers of one CP-SAT solve into stats (a dict, or None) and,
+    when CPSAT_DUMP_DIR is set, save the model of solves slower than
+    CPSAT_DUMP_SECONDS (default 10) there for offline tuning.
+    """
+    solved = status in (cp_model.OPTIMAL, cp_model.FEASIBLE)
+    dump_dir = os.environ.get("CPSAT_DUMP_DIR")
+    dumped = None
+    if dump_dir and solver.WallTime() >= float(os.environ.get("CPSAT_DUMP_SECONDS", 10)):
+        os.makedirs(dump_dir, exist_ok=True)
+        dumped = os.path.join(dump_dir, f"{label}-{os.getpid()}-{time.time_ns()}.pb.txt")
+        model.ExportToFile(dumped)
+    if stats is None:
+        return
+    proto = model.Proto()
+    stats.update({
+        "status": solver.StatusName(status),
+        "wall_time": round(solver.WallTime(), 3),
+        "objective": solver.ObjectiveValue() if solved else None,
+        "best_bound": solver.BestObjectiveBound() if solved else None,
+        "branches": solver.NumBranches(),
+        "conflicts": solver.NumConflicts(),
+        "variables": len(proto.variables),
+        "constraints": len(proto.constraints),
+    })
+    if dumped:
+        stats["model_file"] = dumped
+
+
+class _SolutionStream(cp_model.CpSolverSolutionCallback):
+    """Hands every improving CP-SAT solution, decoded by decode, to on_solution."""
+
+    def __init__(self, decode, on_solution):
+        super().__init__()
+        self._decode = decode
+        self._on_solution = on_solution
+
+    def on_solution_callback(self):
+        self._on_solution(*self._decode(self))
+
+
+def _solve(solver, model, decode=None, on_solution=None, stop=None):
+    """
+    solver.Solve(model), streaming each improving solution to on_solution
+    (decoded by decode, which reads values with .Value) and ending the search
+    with the best solution so far once stop, a threading.Event, is set.
+    """
+    callback = _SolutionStream(decode, on_solution) if on_solution is not None else None
+    if stop is None:
+        return solver.Solve(model, callback)
+    finished = threading.Event()
+
+    def watch():
+        # StopSearch is thread-safe; repeat it in case it lands before Solve starts
+        while not finished.wait(0.1):
+            if stop.is_set():
+                solver.StopSearch()
+
+    threading.Thread(target=watch, name="cp-sat-stop", daemon=True).start()
+    try:
+        return solver.Solve(model, callback)
+    finally:
+        finished.set()
+
+
+def _ffd_patterns(lengths, demand, stock_length, kerf):
+    """First-Fit-Decreasing over grouped demand, as a list of patterns."""
+    bars = []  # [pattern, free]
+    for i, (l, d) in enumerate(zip(lengths, demand)):
+        for _ in range(d):
+            for bar in bars:
+                if l + kerf <= bar[1] + 1e-9:
+                    bar[0][i] += 1
+                    bar[1] -= l + kerf
+                    break
+            else:
+                pattern = [0] * len(lengths)
+                pattern[i] = 1
+                bars.append([pattern, stock_length - l])
+    return [b[0] for b in bars]
+
+
+def _as_patterns(bars, lengths):
+    """Bars (piece lists) as count vectors over lengths, in FFD's order."""
+    index = {l: i for i, l in enumerate(lengths)}
+    patterns = []
+    for bar in bars:
+        pattern = [0] * len(lengths)
+        for l in bar:
+            pattern[index[l]] += 1
+        patterns.append(pattern)
+    # sorted by the count of the longest pieces: the symmetry-breaking order
+    return sorted(patterns, reverse=True)
+
+
+def cutting_stock_with_kerf(stock_length, pieces, kerf=0.0, edge_trim=0, num_workers=None, min_remnant=None, stats=None,
+                            on_solution=None, stop=None, previous=None, time_limit=None, seed=None):
+    """
+    Exact cutting plan with CP-SAT; pieces is a list of (length, count) pairs.
+
+    The model has one integer count per distinct length per bar, with the
+    bin-packing lower bound as a constraint, so the search stops once a plan
+    reaches it. Jobs too large for the time budget are solved by
+    cutting_stock_column_generation instead. With min_remnant, a second pass
+    keeps the bars and concentrates the waste into reusable remnants.
+
+    stats (a dict) receives the solver statistics and the gap to the lower
+    bound. on_solution(bars, leftovers) gets every improving plan and stop
+    (a threading.Event) returns the best one so far. previous, the bars of
+    an earlier plan, is repaired to this demand and used as the hint.
+    """
     stock_length-=2*edge_trim # Descarte de puntas
-    n_pieces = len(pieces)
-    max_bars = n_pieces  # worst case: one piece per bar
+    demand = as_demand(pieces)
+    lengths = [l for l, _ in demand]
+    counts = [d for _, d in demand]
+    n_lengths = len(lengths)
     scale = 1000
     stock_length_int = int(stock_length * scale)
     kerf_int = int(kerf * scale)
-    pieces_int = [int(p * scale) for p in pieces]
+    lengths_int = [int(l * scale) for l in lengths]
+
+    if any(l > stock_length_int for l in lengths_int):
+        return None, None
+
+    # most pieces of each length that fit in one bar
+    per_bar = [min(d, (stock_length_int + kerf_int) // (l + kerf_int)) for l, d in zip(lengths_int, counts)]
+    # First-Fit-Decreasing (or the repaired previous plan) gives the warm
+    # start and the bar upper bound
+    warm_start = _ffd_patterns(lengths, counts, stock_length, kerf)
+    if previous:
+        repaired = _as_patterns(repair_plan(previous, demand, stock_length, kerf)[0], lengths)
+        if len(repaired) <= len(warm_start):
+            warm_start = repaired
+    max_bars = len(warm_start)
+    bound = lower_bound(stock_length, demand, kerf)
+
+    if max_bars == bound and not min_remnant:
+        # nothing can beat the warm start
+        if stats is not None:
+            stats.update({"status": "OPTIMAL", "wall_time": 0.0, "objective": bound, "best_bound": bound,
+                          "lower_bound": bound, "gap": 0})
+        return _expand_patterns([(p, 1) for p in warm_start], lengths, counts, stock_length, kerf)
+
+    large = n_lengths * max_bars / 100 > float(os.environ.get("CPSAT_MAX_SECONDS", MAX_SECONDS))
+    if large:
+        if stats is not None:
+            stats["method"] = "column-generation"
+        bars, leftovers = cutting_stock_column_generation(
+            stock_length, demand, kerf, time_limit=time_limit or 10, num_workers=num_workers, stats=stats,
+            on_solution=on_solution, stop=stop, previous=previous, seed=seed,
+        )
+        if not min_remnant or bars is None or (stop and stop.is_set()):
+            return bars, leftovers
+        # the assignment model below only hosts the min_remnant pass
+        warm_start = _as_patterns(bars, lengths)
+        max_bars = len(warm_start)
 
     model = cp_model.CpModel()
 
-    # x[i][j] = 1 if piece i is cut from bar j
-    x = [[model.NewBoolVar(f"x_{i}_{j}") for j in range(max_bars)] for i in range(n_pieces)]
+    # x[i][j] = number of pieces of length i cut from bar j
+    x = [[model.NewIntVar(0, per_bar[i], f"x_{i}_{j}") for j in range(max_bars)] for i in range(n_lengths)]
     # y[j] = 1 if bar j is used
     y = [model.NewBoolVar(f"y_{j}") for j in range(max_bars)]
 
-    # each piece must be assigned to exactly one bar
-    for i in range(n_pieces):
-        model.Add(sum(x[i][j] for j in range(max_bars)) == 1)
+    # each length must be cut exactly as many times as demanded
+    for i in range(n_lengths):
+        model.Add(sum(x[i][j] for j in range(max_bars)) == counts[i])
 
     # bar capacity + linking constraints
+    max_count = max(per_bar, default=0) * n_lengths
+    loads = []  # length taken from bar j, one kerf per piece
     for j in range(max_bars):
-        pieces_sum = sum(x[i][j] * pieces_int[i] for i in range(n_pieces))
-        count = sum(x[i][j] for i in range(n_pieces))
+        pieces_sum = sum(x[i][j] * lengths_int[i] for i in range(n_lengths))
+        count = sum(x[i][j] for i in range(n_lengths))
+        loads.append(pieces_sum + kerf_int * count)
 
         # capacity constraint
         model.Add(pieces_sum + kerf_int * (count - 1) <= stock_length_int)
 
         # link y[j] with usage
         model.Add(count >= y[j])
-        model.Add(count <= n_pieces * y[j])
+        model.Add(count <= max_count * y[j])
+
+    # symmetry breaking: bars are used in order, sorted by how many of the
+    # longest pieces they hold (lengths are sorted, longest first), and the
+    # longest piece goes to the first bar
+    for j in range(max_bars - 1):
+        model.Add(y[j] >= y[j + 1])
+        model.Add(x[0][j] >= x[0][j + 1])
+    if max_bars:
+        model.Add(x[0][0] >= 1)
+
+    # lower bound: the search stops (OPTIMAL) as soon as a plan reaches it
+    model.Add(sum(y) >= bound)
+
+    # warm start as hint (it already satisfies the symmetry constraints)
+    for j, pattern in enumerate(warm_start):
+        model.AddHint(y[j], 1)
+        for i in range(n_lengths):
+            model.AddHint(x[i][j], pattern[i])
 
     # minimize number of bars used
     model.Minimize(sum(y))
 
-    # solve
-    solver = cp_model.CpSolver()
-    solver.parameters.max_time_in_seconds = 30
-    status = solver.Solve(model)
-
-    if status in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
+    def decode(values):
         bars = []
         leftovers = []
         for j in range(max_bars):
-            bar_pieces = [pieces[i] for i in range(n_pieces) if solver.Value(x[i][j])]
+            bar_pieces = []
+            for i in range(n_lengths):
+                bar_pieces.extend([lengths[i]] * values.Value(x[i][j]))
             if bar_pieces:
                 used_length = sum(bar_pieces) + (len(bar_pieces) - 1) * kerf
                 leftover = stock_length - used_length
                 bars.append(bar_pieces)
                 leftovers.append(round(leftover, 2))
         return bars, leftovers
+
+    if time_limit is None:
+        time_limit = time_budget(n_lengths, max_bars)
+    if large:
+        status, solver = cp_model.FEASIBLE, None
+        plan = warm_start
     else:
+        solver = cp_model.CpSolver()
+        _configure(solver, time_limit, num_workers, seed)
+        status = _solve(solver, model, decode, on_solution, stop)
+        _record_solve(stats, solver, model, status, "cp-sat")
+        plan = [[solver.Value(row[j]) for row in x] for j in range(max_bars) if solver.Value(y[j])] \
+            if status in [cp_model.OPTIMAL, cp_model.FEASIBLE] else None
+
+    if min_remnant and plan is not None and not (stop and stop.is_set()):
+        remnant_stats = None if stats is None else stats.setdefault("remnant_pass", {})
+        status, solver = _concentrate_leftovers(
+            model, plan, x, y, loads, [l + kerf_int for l in lengths_int], stock_length_int + kerf_int,
+            int(min_remnant * scale), num_workers,
+            time_limit=min(10, time_limit), stats=remnant_stats, decode=decode, on_solution=on_solution,
+            stop=stop, seed=seed,
+        ) or (status, solver)
+
+    if solver is None:  # large job: the pass found nothing better in time
+        return _expand_patterns([(p, 1) for p in warm_start], lengths, counts, stock_length, kerf)
+    if status in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
+        bars, leftovers = decode(solver)
+        if stats is not None:
+            stats.update({"lower_bound": bound, "gap": len(bars) - bound})
+        return bars, leftovers
+    else:
+        return None, None
+
+
+def _concentrate_leftovers(model, plan, x, y, loads, sizes, capacity, min_remnant, num_workers, time_limit=10,
+                          stats=None, decode=None, on_solution=None, stop=None, seed=None):
+    """
+    Second lexicographic pass: keep the bar count of plan (the patterns of
+    the bars used, in model order; sizes are the piece lengths plus one
+    kerf) and minimize scrap (leftovers below min_remnant). Returns
+    (status, solver) or None when no better plan is found in time.
+    """
+    model.Add(sum(y) <= len(plan))
+    model.ClearHints()
+    for j in range(len(y)):
+        model.AddHint(y[j], int(j < len(plan)))
+        for i, row in enumerate(x):
+            model.AddHint(row[j], plan[j][i] if j < len(plan) else 0)
+
+    scrap = []
+    for j in range(len(y)):
+        # kerf-adjusted leftover of bar j (0 when the bar is not used)
+        leftover = capacity * y[j] - loads[j]
+        reusable = model.NewBoolVar(f"r_{j}")
+        model.Add(leftover >= min_remnant).OnlyEnforceIf(reusable)
+        waste = model.NewIntVar(0, capacity, f"s_{j}")
+        model.Add(waste >= leftover - capacity * reusable)
+        scrap.append(waste)
+        # complete hint: without it large models find no first solution in time
+        hinted = capacity - sum(a * size for a, size in zip(plan[j], sizes)) if j < len(plan) else 0
+        model.AddHint(reusable, int(hinted >= min_remnant))
+        model.AddHint(waste, 0 if hinted >= min_remnant else hinted)
+    model.ClearObjective()
+    model.Minimize(sum(scrap))
+
+    second = cp_model.CpSolver()
+    _configure(second, time_limit, num_workers, seed)
+    second.parameters.repair_hint = True  # else a lone worker may not even reach the hinted plan
+    status = _solve(second, model, decode, on_solution, stop)
+    _record_solve(stats, second, model, status, "cp-sat-sobrantes")
+    if status in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
+        return status, second
+    return None
+
+
+# ----------------------------------------------------------------------
+# Column generation (Gilmore-Gomory)
+# ----------------------------------------------------------------------
+
+MAX_PRICING_CELLS = 200_000  # knapsack DP resolution (capacity units)
+
+
+def _pricing_units(lengths, stock_length, kerf, scale=1000):
+    """
+    Integer sizes for the pricing knapsack.
+
+    Each piece occupies its length plus one kerf, and the bar gets one
+    extra kerf of capacity (n pieces need n-1 cuts). Sizes are reduced by
+    their common divisor; if the bar is still too fine-grained, sizes are
+    rounded up and the capacity down, which never yields infeasible patterns
+    but may miss some (exact is then False and pricing proves nothing).
+    """
+    sizes = [int(round((l + kerf) * scale)) for l in lengths]
+    capacity = int(round((stock_length + kerf) * scale))
+
+    unit = math.gcd(capacity, *sizes)
+    exact = capacity // unit <= MAX_PRICING_CELLS
+    if not exact:
+        unit = -(-capacity // MAX_PRICING_CELLS)
+
+    sizes = [-(-s // unit) for s in sizes]
+    return sizes, capacity // unit, exact
+
+
+def _best_pattern(sizes, values, bounds, capacity):
+    """Bounded knapsack (binary splitting) returning (value, pattern)."""
+    best = np.zeros(capacity + 1)
+    chunks = []
+    for i, (size, value, bound) in enumerate(zip(sizes, values, bounds)):
+        k = 1
+        while bound > 0 and value > 0:
+            m = min(k, bound)
+            bound -= m
+            k *= 2
+            w = size * m
+            if w > capacity:
+                break
+            gain = best[:capacity + 1 - w] + value * m
+            take = np.zeros(capacity + 1, dtype=bool)
+            take[w:] = gain > best[w:] + 1e-12
+            best[w:][take[w:]] = gain[take[w:]]
+            chunks.append((i, m, w, take))
+
+    pattern = [0] * len(sizes)
+    c = capacity
+    for i, m, w, take in reversed(chunks):
+        if take[c]:
+            pattern[i] += m
+            c -= w
+    return best[capacity], pattern
+
+
+def cutting_stock_column_generation(stock_length, pieces, kerf=0.0, edge_trim=0, time_limit=10, num_workers=None, stats=None,
+                                    on_solution=None, stop=None, previous=None, seed=None):
+    """
+    Gilmore-Gomory column generation for the cutting stock problem.
+
+    pieces is a list of (length, count) pairs. Patterns are priced with a
+    bounded knapsack over the distinct lengths, the pattern LP is solved
+    with GLOP, and the LP solution is rounded down with the remaining
+    demand packed by FFD. Only when that plan is more than one bar above
+    the LP bound does a small CP-SAT model over the generated patterns
+    look for better integer bar counts. The sizes depend on the number of
+    distinct lengths, not on the number of pieces, so thousands of cuts
+    per code solve in seconds.
+
+    Integer solutions over the generated patterns only (price-and-branch)
+    are not proven optimal: the status is OPTIMAL only when the plan meets
+    the lower bound or the LP bound of a pricing loop that converged (or
+    reached the Farley bound), FEASIBLE otherwise.
+
+    Returns the same (bars, leftovers) as cutting_stock_with_kerf; stats
+    gets the integer master's CP-SAT statistics plus the LP's columns,
+    bound and time, the lower bound and the gap. on_solution, stop,
+    previous, seed and the early stop at the lower bound work as in
+    cutting_stock_with_kerf (stop also ends the pricing loop; the repaired
+    previous plan replaces the FFD starting columns).
+    """
+    stock_length -= 2 * edge_trim  # Descarte de puntas
+    grouped = as_demand(pieces)
+    if not grouped:
+        return [], []
+    if any(l > stock_length for l, _ in grouped):
         return None, None
 
+    lengths = [l for l, _ in grouped]
+    demand = [d for _, d in grouped]
+    n = len(lengths)
+    sizes, capacity, exact_pricing = _pricing_units(lengths, stock_length, kerf)
+
+    # Initial columns: the distinct patterns of the starting plan (FFD, or
+    # the repaired previous plan when it needs no more bars) plus one
+    # homogeneous pattern per length
+    start_plan = _ffd_patterns(lengths, demand, stock_length, kerf)
+    if previous:
+        repaired = _as_patterns(repair_plan(previous, grouped, stock_length, kerf)[0], lengths)
+        if len(repaired) <= len(start_plan):
+            start_plan = repaired
+    n_start = len(start_plan)
+    bound = lower_bound(stock_length, grouped, kerf)
+    if n_start == bound:
+        # nothing can beat the starting plan: no LP needed
+        if stats is not None:
+            stats.update({"status": "OPTIMAL", "wall_time": 0.0, "objective": bound, "best_bound": bound,
+                          "lower_bound": bound, "gap": 0})
+        return _expand_patterns([(p, 1) for p in start_plan], lengths, demand, stock_length, kerf)
+    start_counts = {}
+    for pattern in start_plan:
+        start_counts[tuple(pattern)] = start_counts.get(tuple(pattern), 0) + 1
+    patterns = [list(p) for p in start_counts]
+    for i in range(n):
+        pattern = [0] * n
+        pattern[i] = max(1, min(demand[i], capacity // sizes[i]))
+        if tuple(pattern) not in start_counts:
+            patterns.append(pattern)
+
+    # Master LP
+    lp = pywraplp.Solver.CreateSolver("GLOP")
+    rows = [lp.Constraint(d, lp.infinity()) for d in demand]
+    objective = lp.Objective()
+    objective.SetMinimization()
+    columns = []
+
+    def add_column(pattern):
+        var = lp.NumVar(0, lp.infinity(), f"p_{len(columns)}")
+        objective.SetCoefficient(var, 1)
+        for i, a in enumerate(pattern):
+            if a:
+                rows[i].SetCoefficient(var, a)
+        columns.append(var)
+
+    for pattern in patterns:
+        add_column(pattern)
+
+    start = time.monotonic()
+    lp_values = []
+    # ceil(z) only bounds the integer optimum once pricing has converged; before
+    # that the Farley bound z / (best pattern value) does. Neither holds when
+    # the pricing knapsack is rounded (it may miss the best pattern).
+    lp_bound = 0
+    seen = {tuple(p) for p in patterns}
+    while time.monotonic() - start < time_limit / 2 and not (stop and stop.is_set()):
+        if lp.Solve() != pywraplp.Solver.OPTIMAL:
+            break
+        z = objective.Value()
+        lp_values = [v.solution_value() for v in columns]
+        duals = [r.dual_value() for r in rows]
+        value, pattern = _best_pattern(sizes, duals, demand, capacity)
+        if value <= 1 + 1e-9:
+            if exact_pricing:
+                lp_bound = math.ceil(z - 1e-6)  # converged
+            break
+        if exact_pricing:
+            lp_bound = max(lp_bound, math.ceil(z / value - 1e-6))
+        # Farley bound: stop once more columns cannot raise the integer bound
+        if lp_bound >= math.ceil(z - 1e-6) or tuple(pattern) in seen:
+            break
+        seen.add(tuple(pattern))
+        patterns.append(pattern)
+        add_column(pattern)
+
+    lp_seconds = time.monotonic() - start
+    lp_values += [0.0] * (len(columns) - len(lp_values))
+
+    # Rounding: the LP solution rounded down, plus FFD over the demand it
+    # leaves uncovered. Usually within a bar or two of the LP bound.
+    floors = [math.floor(v + 1e-9) for v in lp_values]
+    covered = [sum(p[i] * f for p, f in zip(patterns, floors)) for i in range(n)]
+    rounded = {tuple(p): f for p, f in zip(patterns, floors) if f}
+    for pattern in _ffd_patterns(lengths, [max(0, d - c) for d, c in zip(demand, covered)], stock_length, kerf):
+        rounded[tuple(pattern)] = rounded.get(tuple(pattern), 0) + 1
+    best = rounded if sum(rounded.values()) < n_start else start_counts
+    n_best = sum(best.values())
+    for pattern in best:
+        if pattern not in seen:
+            seen.add(pattern)
+            patterns.append(list(pattern))
+    target = max(bound, lp_bound)
+
+    status = None
+    if n_best > target and not (lp_bound and n_best <= lp_bound + 1) and not (stop and stop.is_set()):
+        # Integer master over the generated patterns, hinted with that plan
+        model = cp_model.CpModel()
+        counts = []
+        for pattern in patterns:
+            ub = max(-(-demand[i] // a) for i, a in enumerate(pattern) if a)
+            counts.append(model.NewIntVar(0, ub, f"n_{len(counts)}"))
+            model.AddHint(counts[-1], min(ub, best.get(tuple(pattern), 0)))
+        for i in range(n):
+            model.Add(sum(p[i] * c for p, c in zip(patterns, counts)) >= demand[i])
+        model.Add(sum(counts) >= target)
+        model.Minimize(sum(counts))
+
+        def decode(values):
+            return _expand_patterns(
+                [(p, values.Value(c)) for p, c in zip(patterns, counts)], lengths, demand, stock_length, kerf
+            )
+
+        solver = cp_model.CpSolver()
+        _configure(solver, max(1.0, time_limit - (time.monotonic() - start)), num_workers, seed)
+        status = _solve(solver, model, decode, on_solution, stop)
+        _record_solve(stats, solver, model, status, "column-generation")
+
+    if status in [cp_model.OPTIMAL, cp_model.FEASIBLE] and solver.ObjectiveValue() <= n_best:
+        bars, leftovers = decode(solver)
+    else:
+        bars, leftovers = _expand_patterns([(list(p), c) for p, c in best.items()], lengths, demand, stock_length, kerf)
+        if status is None and stats is not None:
+            stats.update({"wall_time": 0.0, "objective": n_best})
+    if stats is not None and status in [None, cp_model.OPTIMAL, cp_model.FEASIBLE, cp_model.UNKNOWN]:
+        # the master's own status and bound only cover the generated patterns
+        stats.update({"status": "OPTIMAL" if len(bars) <= target else "FEASIBLE", "best_bound": target})
+    if stats is not None:
+        stats.update({
+            "lp_columns": len(patterns), "lp_bound": lp_bound, "lp_seconds": round(lp_seconds, 3),
+            "lower_bound": bound, "gap": len(bars) - bound,
+        })
+    return bars, leftovers
+
+
+def _expand_patterns(chosen, lengths, demand, stock_length, kerf):
+    """(pattern, times) pairs into (bars, leftovers), dropping over-produced pieces."""
+    remaining = demand[:]
+    bars = []
+    leftovers = []
+    for pattern, times in chosen:
+        for _ in range(times):
+            bar_pieces = []
+            for i, a in enumerate(pattern):
+                take = min(a, remaining[i])
+                remaining[i] -= take
+                bar_pieces.extend([lengths[i]] * take)
+            if bar_pieces:
+                used_length = sum(bar_pieces) + (len(bar_pieces) - 1) * kerf
+                bars.append(bar_pieces)
+                leftovers.append(round(stock_length - used_length, 2))
+    return bars, leftovers
+
+
+# ----------------------------------------------------------------------
+# Heuristic (Best-Fit-Decreasing + local search) and lower bounds
+# ----------------------------------------------------------------------
+
+def lower_bound(stock_length, pieces, kerf=0.0, edge_trim=0):
+    """
+    Bin-packing lower bound max(L1, L2) on the number of bars.
+
+    Kerf is folded in by giving each piece one kerf and the bar one extra
+    kerf of capacity, which is exact for n pieces and n-1 cuts.
+    """
+    demand = as_demand(pieces)
+    if not demand:
+        return 0
+    capacity = stock_length - 2 * edge_trim + kerf
+    sizes = [(l + kerf, d) for l, d in demand]
+
+    # L1: continuous bound
+    best = math.ceil(sum(w * d for w, d in sizes) / capacity - 1e-9)
+
+    # L2 (Martello-Toth): pieces above half a bar never share one
+    for alpha in {0} | {w for w, _ in sizes if w <= capacity / 2}:
+        n_large = 0
+        free_large = 0
+        small = 0
+        for w, d in sizes:
+            if w > capacity - alpha:
+                n_large += d
+            elif w > capacity / 2:
+                n_large += d
+                free_large += (capacity - w) * d
+            elif w >= alpha:
+                small += w * d
+        best = max(best, n_large + max(0, math.ceil((small - free_large) / capacity - 1e-9)))
+    return best
+
+
+def _bfd_bars(demand, capacity, kerf, bars=None):
+    """
+    Best-Fit-Decreasing; bars are [free, pieces] in kerf-adjusted units.
+    Pieces go into the free space of the given bars before new ones.
+    """
+    bars = [] if bars is None else bars
+    free = sorted((b[0], i) for i, b in enumerate(bars))  # sorted (free, bar index)
+    for l, d in demand:
+        w = l + kerf
+        for _ in range(d):
+            k = bisect.bisect_left(free, (w - 1e-9, -1))
+            if k < len(free):
+                room, b = free.pop(k)
+                bars[b][0] = room - w
+                bars[b][1].append(l)
+            else:
+                b = len(bars)
+                bars.append([capacity - w, [l]])
+            bisect.insort(free, (bars[b][0], b))
+    return bars
+
+
+def _repair_bars(previous, demand, capacity, kerf):
+    """repair_plan in the [free, pieces] form of _bfd_bars."""
+    need = dict(demand)
+    kept = []
+    # the fullest bars keep their pieces; surplus comes out of the emptiest
+    for bar in sorted(previous, key=lambda b: sum(b) + len(b) * kerf, reverse=True):
+        free = capacity
+        bar_pieces = []
+        for l in sorted(bar, reverse=True):
+            if need.get(l, 0) > 0 and l + kerf <= free + 1e-9:
+                need[l] -= 1
+                free -= l + kerf
+                bar_pieces.append(l)
+        if bar_pieces:
+            kept.append([free, bar_pieces])
+    missing = sorted(((l, d) for l, d in need.items() if d > 0), reverse=True)
+    return _bfd_bars(missing, capacity, kerf, kept)
+
+
+def repair_plan(bars, pieces, stock_length, kerf=0.0, edge_trim=0):
+    """
+    Adapt the bars of an earlier plan to a changed demand, keeping their
+    patterns: surplus pieces leave the least filled bars, pieces that no
+    longer fit (e.g. a wider kerf) are taken out, and the missing ones go
+    Best-Fit-Decreasing into the free space left and then into new bars.
+
+    Returns the same (bars, leftovers) as cutting_stock_with_kerf in
+    milliseconds: a usable plan while the engines re-solve.
+    """
+    stock_length -= 2 * edge_trim  # Descarte de puntas
+    demand = as_demand(pieces)
+    if any(l > stock_length for l, _ in demand):
+        return None, None
+    repaired = _repair_bars(bars, demand, stock_length + kerf, kerf)
+    return [b[1] for b in repaired], [round(b[0], 2) for b in repaired]
+
+
+def _empty_bar(bars, target, kerf):
+    """Try to move every piece of bars[target] into the other bars."""
+    room = [b[0] for b in bars]
+    moves = []
+    for l in sorted(bars[target][1], reverse=True):
+        w = l + kerf
+        fits = [b for b in range(len(bars)) if b != target and room[b] >= w - 1e-9]
+        if not fits:
+            return False
+        b = min(fits, key=lambda b: room[b])
+        room[b] -= w
+        moves.append((b, l))
+    for b, l in moves:
+        bars[b][1].append(l)
+        bars[b][0] -= l + kerf
+    bars.pop(target)
+    return True
+
+
+def _shrink_bar(bars, target, kerf):
+    """Swap one piece of bars[target] for a shorter one from another bar."""
+    for a in sorted(bars[target][1], reverse=True):
+        for b, (room, pieces) in enumerate(bars):
+            if b == target:
+                continue
+            for c in sorted(set(pieces)):
+                if c >= a or room + c - a < -1e-9:
+                    continue
+                bars[target][1].remove(a)
+                bars[target][1].append(c)
+                bars[target][0] += a - c
+                pieces.remove(c)
+                pieces.append(a)
+                bars[b][0] = room + c - a
+                return True
+    return False
+
+
+def cutting_stock_heuristic(stock_length, pieces, kerf=0.0, edge_trim=0, time_limit=0.5, stats=None, previous=None):
+    """
+    Best-Fit-Decreasing followed by a local search that tries to empty the
+    least filled bar, moving its pieces into the others and swapping them
+    for shorter ones when they do not fit. Runs in milliseconds. With
+    previous (bars of an earlier plan) the search starts from the repaired
+    previous plan when it needs no more bars than Best-Fit.
+
+    Returns the same (bars, leftovers) as cutting_stock_with_kerf.
+    """
+    stock_length -= 2 * edge_trim  # Descarte de puntas
+    demand = as_demand(pieces)
+    if any(l > stock_length for l, _ in demand):
+        return None, None
+
+    bars = _bfd_bars(demand, stock_length + kerf, kerf)
+    if previous:
+        repaired = _repair_bars(previous, demand, stock_length + kerf, kerf)
+        if len(repaired) <= len(bars):
+            bars = repaired
+    bound = lower_bound(stock_length, demand, kerf)
+
+    deadline = time.monotonic() + time_limit
+    while len(bars) > bound and time.monotonic() < deadline:
+        target = max(range(len(bars)), key=lambda b: bars[b][0])
+        if _empty_bar(bars, target, kerf):
+            continue
+        if not _shrink_bar(bars, target, kerf):
+            break
+
+    if stats is not None:
+        stats.update({
+            "status": "OPTIMAL" if len(bars) == bound else "HEURISTIC",
+            "wall_time": round(time.monotonic() - deadline + time_limit, 3),
+            "objective": len(bars),
+            "best_bound": bound,
+            "lower_bound": bound,
+            "gap": len(bars) - bound,
+        })
+
+    bars = sorted((sorted(b[1], reverse=True) for b in bars), reverse=True)
+    leftovers = [round(stock_length - (sum(b) + (len(b) - 1) * kerf), 2) for b in bars]
+    return bars, leftovers
+
+
+ENGINES = {
+    "cp-sat": cutting_stock_with_kerf,
+    "column-generation": cutting_stock_column_generation,
+    "heuristic": cutting_stock_heuristic,
+}
+
+
+# ----------------------------------------------------------------------
+# Stock-aware cutting: remnant bars first, then new bars
+# ----------------------------------------------------------------------
+
+def _bfd_with_remnants(demand, remnant_caps, capacity, kerf):
+    """
+    Best-Fit-Decreasing over the remnants (always open) and new bars.
+    Returns bins as [free, pieces, remnant index or None], kerf-adjusted.
+    """
+    bins = [[cap + kerf, [], r] for r, cap in enumerate(remnant_caps)]
+    # (free, bin) kept sorted: the best fit for a piece is one bisection away
+    free = sorted((b[0], i) for i, b in enumerate(bins))
+    for l, d in demand:
+        w = l + kerf
+        for _ in range(d):
+            k = bisect.bisect_left(free, (w - 1e-9, -1))
+            if k < len(free):
+                _, i = free.pop(k)
+            else:
+                i = len(bins)
+                bins.append([capacity, [], None])
+            b = bins[i]
+            b[0] -= w
+            b[1].append(l)
+            bisect.insort(free, (b[0], i))
+    return [b for b in bins if b[1]]
+
+
+def cutting_stock_with_remnants(stock_length, pieces, remnants, kerf=0.0, edge_trim=0, num_workers=None, heuristic=False, time_limit=5, stats=None,
+                                on_solution=None, stop=None, seed=None):
+    """
+    Variable-size cutting: fill the remnant bars from the stock ledger first
+    and buy new bars of stock_length only for what does not fit.
+
+    remnants is a list of stock bars ({"posicion", "codigo", "largo"}). Edge
+    trim is applied to remnants as well. The CP-SAT model minimizes new bars
+    first and then the total length of remnants consumed, so long remnants
+    are kept when short ones suffice; the search stops after time_limit
+    seconds with the best plan found. With heuristic=True the Best-Fit warm
+    start is returned directly.
+
+    Returns (bars, leftovers, origins); origins[j] is the remnant bar j is
+    cut from, or None for a new bar. stats, on_solution (called with
+    bars, leftovers, origins), stop and seed work as in
+    cutting_stock_with_kerf.
+    """
+    stock_length -= 2 * edge_trim  # Descarte de puntas
+    demand = as_demand(pieces)
+    if any(l > stock_length for l, _ in demand):
+        return None, None, None
+
+    shortest = min((l for l, _ in demand), default=0)
+    remnants = sorted(
+        (r for r in remnants if r["largo"] - 2 * edge_trim >= shortest),
+        key=lambda r: r["largo"],
+    )
+    caps = [r["largo"] - 2 * edge_trim for r in remnants]
+
+    def finish(plan):
+        bars = []
+        leftovers = []
+        origins = []
+        for bar_pieces, r in sorted(plan, key=lambda p: p[1] is None):
+            capacity = stock_length if r is None else caps[r]
+            used_length = sum(bar_pieces) + (len(bar_pieces) - 1) * kerf
+            bars.append(sorted(bar_pieces, reverse=True))
+            leftovers.append(round(capacity - used_length, 2))
+            origins.append(None if r is None else remnants[r])
+        return bars, leftovers, origins
+
+    warm_start = _bfd_with_remnants(demand, caps, stock_length + kerf, kerf)
+    if heuristic or not demand:
+        plan = [(pieces_, r) for _, pieces_, r in warm_start]
+        if stats is not None:
+            stats.update({"status": "HEURISTIC", "objective": sum(r is None for _, _, r in warm_start)})
+    else:
+        on_plan = None if on_solution is None else lambda plan: on_solution(*finish(plan))
+        plan = _solve_remnants_model(
+            demand, caps, stock_length, kerf, warm_start, num_workers, time_limit, stats, on_plan, stop, seed
+        )
+    return finish(plan)
+
+
+def _solve_remnants_model(demand, caps, stock_length, kerf, warm_start, num_workers, time_limit, stats=None,
+                          on_plan=None, stop=None, seed=None):
+    """
+    CP-SAT over remnant bins plus new bins; returns [(pieces, remnant index
+    or None)], and passes every improving one to on_plan.
+    """
+    lengths = [l for l, _ in demand]
+    counts = [d for _, d in demand]
+    n_lengths = len(lengths)
+    scale = 1000
+    kerf_int = int(kerf * scale)
+    lengths_int = [int(l * scale) for l in lengths]
+
+    n_remnants = len(caps)
+    n_new = sum(1 for _, _, r in warm_start if r is None)
+    bin_caps = [int(c * scale) for c in caps] + [int(stock_length * scale)] * n_new
+    n_bins = len(bin_caps)
+
+    model = cp_model.CpModel()
+    x = [
+        [model.NewIntVar(0, min(counts[i], (bin_caps[b] + kerf_int) // (lengths_int[i] + kerf_int)), f"x_{i}_{b}")
+         for b in range(n_bins)]
+        for i in range(n_lengths)
+    ]
+    y = [model.NewBoolVar(f"y_{b}") for b in range(n_bins)]
+
+    for i in range(n_lengths):
+        model.Add(sum(x[i]) == counts[i])
+
+    for b in range(n_bins):
+        count = sum(x[i][b] for i in range(n_lengths))
+        model.Add(sum(x[i][b] * lengths_int[i] for i in range(n_lengths)) + kerf_int * (count - 1) <= bin_caps[b])
+        model.Add(count >= y[b])
+        model.Add(count <= sum(counts) * y[b])
+
+    # symmetry breaking among interchangeable bins: remnants of equal length
+    # and all new bars are used in order
+    for b in range(n_bins - 1):
+        if bin_caps[b] == bin_caps[b + 1]:
+            model.Add(y[b] >= y[b + 1])
+            if b >= n_remnants:
+                model.Add(x[0][b] >= x[0][b + 1])
+
+    # hint: remnant bins keep their index, new bars fill the tail in order
+    new_bin = n_remnants
+    for _, bin_pieces, r in warm_start:
+        if r is None:
+            b, new_bin = new_bin, new_bin + 1
+        else:
+            b = r
+        model.AddHint(y[b], 1)
+        for i in range(n_lengths):
+            model.AddHint(x[i][b], bin_pieces.count(lengths[i]))
+
+    # whatever does not fit in the remnants needs new bars
+    overflow = sum((l + kerf) * d for l, d in demand) - sum(c + kerf for c in caps)
+    model.Add(sum(y[n_remnants:]) >= max(0, math.ceil(overflow / (stock_length + kerf) - 1e-9)))
+
+    # lexicographic: new bars first, then remnant length consumed
+    weight = sum(int(c) for c in caps) + 1
+    model.Minimize(
+        weight * sum(y[n_remnants:])
+        + sum(int(caps[r]) * y[r] for r in range(n_remnants))
+    )
+
+    def decode(values):
+        plan = []
+        for b in range(n_bins):
+            bin_pieces = []
+            for i in range(n_lengths):
+                bin_pieces.extend([lengths[i]] * values.Value(x[i][b]))
+            if bin_pieces:
+                plan.append((bin_pieces, b if b < n_remnants else None))
+        return (plan,)
+
+    solver = cp_model.CpSolver()
+    _configure(solver, time_limit, num_workers, seed)
+    status = _solve(solver, model, decode, on_plan, stop)
+    _record_solve(stats, solver, model, status, "remnants")
+
+    if status not in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
+        return [(bin_pieces, r) for _, bin_pieces, r in warm_start]
+    return decode(solver)[0]
+
+
+# ----------------------------------------------------------------------
+# Parallel solving of independent codes
+# ----------------------------------------------------------------------
+
+def _pool_context():
+    """
+    Forking a threaded server process (Streamlit) is not safe. A forkserver
+    is single-threaded and preloads this module, so workers start in
+    milliseconds instead of re-importing everything; spawn is the fallback
+    where forkserver is not available (Windows).
+    """
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload([__name__])
+    return context
+
+
+def _solve_job(engine, code, job, kerf, edge_trim, num_workers, min_remnant=None, on_solution=None, stop=None, seed=None,
+               cache=None):
+    """Solve one code, through cache when given; returns (code, bars, leftovers, origins, stats)."""
+    stats = {"engine": engine}
+    if stop is not None and stop.is_set():
+        stats["status"] = "CANCELLED"
+        return code, None, None, None, stats
+    start = time.perf_counter()
+    options = {"stats": stats}
+    if job.get("remnants"):
+        solver = functools.partial(cutting_stock_with_remnants, heuristic=engine == "heuristic")
+        options.update(remnants=job["remnants"], num_workers=num_workers, stop=stop, seed=seed)
+        if on_solution is not None:
+            options["on_solution"] = lambda *plan: on_solution(code, *plan)
+    elif engine == "heuristic":
+        solver = cutting_stock_heuristic
+        options["previous"] = job.get("previous")
+    else:
+        solver = ENGINES[engine]
+        options.update(num_workers=num_workers, stop=stop, previous=job.get("previous"), seed=seed)
+        # only the exact engine concentrates leftovers into remnants
+        if engine == "cp-sat" and min_remnant:
+            options["min_remnant"] = min_remnant
+        if on_solution is not None:
+            options["on_solution"] = lambda bars, leftovers: on_solution(code, bars, leftovers, [None] * len(bars))
+    if cache is not None:
+        solver = cache.cached(engine)(solver)
+    bars, leftovers, *origins = solver(job["stock_length"], job["pieces"], kerf=kerf, edge_trim=edge_trim, **options)
+    origins = origins[0] if origins else None if bars is None else [None] * len(bars)
+    stats["seconds"] = round(time.perf_counter() - start, 3)
+    stats["bars"] = None if bars is None else len(bars)
+    return code, bars, leftovers, origins, stats
+
+
+def solve_codes(jobs, engine="cp-sat", kerf=0.0, edge_trim=0, max_workers=None, cpu_budget=None, cache=None, min_remnant=None, stats=None,
+                on_solution=None, stop=None, seed=None):
+    """
+    Solve every code of jobs ({code: {"stock_length", "pieces"}}) and yield
+    (code, bars, leftovers, origins) as each one finishes.
+
+    A job may carry "remnants" (stock bars of that code); they are then
+    filled before new bars and origins tells which remnant each bar comes
+    from (None for a new bar). A job without remnants may carry "previous",
+    the bars of an earlier plan to warm-start from. min_remnant is passed
+    to the exact engine.
+
+    The codes are independent, so they are sent to a pool of max_workers
+    processes and the CPU budget (default: CPSAT_WORKERS, else all cores)
+    is split among them as CP-SAT workers; seed goes to every CP-SAT
+    solve. Wall-clock time is roughly that of the slowest code. The
+    heuristic engine runs inline since it takes milliseconds.
+
+    With a SolutionCache, every engine call goes through cache.cached():
+    cached codes return at once and the others are stored once solved.
+
+    If stats is a dict, stats[code] gets each code's solver statistics
+    (status "CACHE" for cache hits); they are also sent to telemetry.
+
+    on_solution(code, bars, leftovers, origins) receives the improving plans
+    found while each code is being solved, and setting stop (a
+    threading.Event) cancels the job: running searches return their best
+    plan so far and codes not started yet yield None. Progress cannot cross
+    process boundaries, so with either of them the codes are solved on
+    threads (CP-SAT releases the GIL while it searches). Plans cut short by
+    stop are not cached.
+    """
+    if not jobs:
+        return
+    cpu_budget = cpu_budget or int(os.environ.get("CPSAT_WORKERS") or 0) or os.cpu_count() or 1
+    max_workers = max(1, min(max_workers or cpu_budget, cpu_budget, len(jobs)))
+    num_workers = max(1, cpu_budget // max_workers)
+
+    if engine == "heuristic" or max_workers == 1:
+        results = (
+            _solve_job(engine, code, job, kerf, edge_trim, num_workers, min_remnant, on_solution, stop, seed, cache)
+            for code, job in jobs.items()
+        )
+        for code, bars, leftovers, origins, job_stats in results:
+            _report(stats, code, job_stats)
+            yield code, bars, leftovers, origins
+        return
+
+    if on_solution is None and stop is None:
+        executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=_pool_context())
+    else:
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cortes")
+    with executor as pool:
+        futures = [
+            pool.submit(
+                _solve_job, engine, code, job, kerf, edge_trim, num_workers, min_remnant, on_solution, stop, seed, cache
+            )
+            for code, job in jobs.items()
+        ]
+        for future in as_completed(futures):
+            code, bars, leftovers, origins, job_stats = future.result()
+            _report(stats, code, job_stats)
+            yield code, bars, leftovers, origins
+
+
+def _report(stats, code, job_stats):
+    if stats is not None:
+        stats[code] = job_stats
+    telemetry.record_solve(code, job_stats)
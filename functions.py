@@ -1,8 +1,11 @@
-import yaml
+import os
+
 import streamlit as st
 from github import Github
 
-STOCK_FILE = "stock_aluminio.yaml"
+from stock import STOCK_FILE
+from stock_store import FileStockBackend, GitHubStockBackend, StockLedger
+import telemetry
 
 def render_product_card(index, item, product, parts):
 
@@ -58,181 +61,78 @@ def render_product_card(index, item, product, parts):
             st.rerun()
 
 
-def get_product_by_name(name: str, products: list):
-    for p in products:
-        if p["tipologia"] == name:
-            return p
-    return None
-
-def load_parts(filepath: str):
-    """Load parts.yaml into a dict with int codes as keys."""
-    with open(filepath, "r", encoding="utf-8") as f:
-        parts = yaml.safe_load(f)
-    return {k: v for k, v in parts.items()}
-
-def load_product(filepath: str):
-    """Load a product YAML (keeps codes as ints)."""
-    with open(filepath, "r", encoding="utf-8") as f:
-        product = yaml.safe_load(f)
-
-    for sel in product.get("selecciones", []):
-        sel["opciones"] = [c for c in sel["opciones"]]
-
-    for item in product.get("items_fijos", []):
-        item["codigo"] = item["codigo"]
-
-    return product
+def get_repo():
+    """Return the GitHub repository object."""
+    github = Github(_setting("GITHUB_TOKEN"))
+    return github.get_repo(_setting("GITHUB_REPO"))
 
-def get_available_decisions(product, user_selection):
-    return {sel["nombre"]: sel["opciones"][:] for sel in product["selecciones"]}
 
-def calcular_medida(medida, A: int, H: int) -> float:
-    if isinstance(medida, int):
-        return medida
+def _setting(name, default=None):
+    """Value from Streamlit secrets, then the environment."""
     try:
-        expr = medida.replace("A", str(A)).replace("H", str(H))
-        return eval(expr)
-    except:
-        return None
-
-def apply_rules(product, user_selection) -> dict:
-    rules = product.get("rules", [])
-    result = {}
-
-    for rule in rules:
-        condition = rule.get("condition", {}).get("selection", {})
-        if all(str(user_selection.get(k)) == str(v) for k, v in condition.items()):
-            for action in rule.get("actions", []):
-                if action.get("type") == "update_measure":
-                    result[action["target"]] = action["value"]
-
-    return result
-
-
-def build_bom_perfiles(user_selection, product, parts, ancho, alto):
-    measures = {sel["nombre"]: sel.get("medida") for sel in product["selecciones"]}
-    medidas_por_reglas = apply_rules(product, user_selection)
-    bom = []
-
-    # Fixed items
-    for item in product.get("items_fijos", []):
-        if parts[item["codigo"]]["tipo"] == "perfil":
-            bom.append({
-                "codigo": item["codigo"],
-                "descripcion": parts[item["codigo"]]["descripcion"],
-                "especificacion_medida": item["medida"],
-                "medida_calculada": calcular_medida(item["medida"], ancho, alto),
-                "cantidad": item["cantidad"],
-            })
-
-    # User selections
-    for sel in product.get("selecciones", []):
-        if sel["nombre"] in user_selection:
-            codigo = int(user_selection[sel["nombre"]])
-            if parts[codigo]["tipo"] == "perfil":
-                especificacion_medida = measures.get(sel["nombre"], sel.get("medida"))
-                if especificacion_medida is None:
-                    especificacion_medida = medidas_por_reglas[sel["nombre"]]
-                bom.append({
-                    "codigo": codigo,
-                    "descripcion": parts[codigo]["descripcion"],
-                    "especificacion_medida": especificacion_medida,
-                    "medida_calculada": calcular_medida(especificacion_medida, ancho, alto),
-                    "cantidad": sel["cantidad"],
-                })
-
-    return bom
-
-
-def build_bom_accesorios(user_selection, product, parts):
-    bom = []
-
-    # Fixed items
-    for item in product.get("items_fijos", []):
-        if parts[item["codigo"]]["tipo"] == "accesorio":
-            bom.append({
-                "codigo": item["codigo"],
-                "descripcion": parts[item["codigo"]]["descripcion"],
-                "precio unidad": parts[item["codigo"]]["precio"],
-                "cantidad": item["cantidad"],
-                "precio total": parts[item["codigo"]]["precio"] * item["cantidad"]
-            })
-            
-    # User selections
-    for sel in product.get("selecciones", []):
-        if sel["nombre"] in user_selection:
-            codigo = int(user_selection[sel["nombre"]])
-            if parts[codigo]["tipo"] == "accesorio":
-                bom.append({
-                    "codigo": codigo,
-                    "descripcion": parts[codigo]["descripcion"],
-                    "precio unidad": parts[codigo]["precio"],
-                    "cantidad": sel["cantidad"],
-                    "precio total": parts[codigo]["precio"]*sel["cantidad"]
-                })
-    return bom
+        if name in st.secrets:
+            return st.secrets[name]
+    except FileNotFoundError:
+        pass
+    return os.environ.get(name, default)
 
 
-def get_repo():
-    """Return the GitHub repository object."""
-    github = Github(st.secrets["GITHUB_TOKEN"])
-    return github.get_repo(st.secrets["GITHUB_REPO"])
+@st.cache_resource
+def stock_ledger():
+    """
+    The stock ledger shared by every session.
+
+    STOCK_BACKEND selects the storage: "github" (default when a
+    GITHUB_TOKEN is configured) or "local", a YAML file at STOCK_PATH.
+    """
+    backend = _setting("STOCK_BACKEND") or ("github" if _setting("GITHUB_TOKEN") else "local")
+    if backend == "local":
+        return StockLedger(FileStockBackend(_setting("STOCK_PATH", STOCK_FILE)))
+    return StockLedger(GitHubStockBackend(get_repo, STOCK_FILE, branch=_setting("GITHUB_BRANCH", "main")))
 
 
-@st.cache_data(ttl=30)
-def load_stock():
+def load_stock(fresh=False):
     """
-    Load stock from GitHub.
+    Load the stock ledger, from memory when possible.
 
     Returns:
         stock (list): List of bars.
-        sha (str): SHA of the file currently in GitHub.
-    """
-    repo = get_repo()
+        sha (str): Version of the ledger the list was read from.
 
-    branch = st.secrets.get("GITHUB_BRANCH", "main")
-
-    file = repo.get_contents(STOCK_FILE, ref=branch)
-
-    data = yaml.safe_load(
-        file.decoded_content.decode("utf-8")
-    )
+    With fresh=True the ledger is re-read from storage first (use it right
+    before applying changes).
+    """
+    with telemetry.stage("stock.leer", fresh=fresh):
+        return stock_ledger().load(fresh=fresh)
 
-    if data is None:
-        data = {}
 
-    return data.get("barras", []), file.sha
+def load_stock_index():
+    """StockIndex of the ledger (per-code, length-sorted; read-only)."""
+    with telemetry.stage("stock.indice"):
+        return stock_ledger().index()
 
 
 def save_stock(stock, sha):
     """
-    Save stock to GitHub.
+    Save stock to the ledger storage.
 
     Parameters
     ----------
     stock : list
         List of dictionaries describing the bars.
     sha : str
-        SHA returned by load_stock().
+        Version returned by load_stock(); raises StockConflict if the
+        ledger changed since.
     """
+    with telemetry.stage("stock.guardar"):
+        stock_ledger().save(stock, sha)
 
-    repo = get_repo()
 
-    branch = st.secrets.get("GITHUB_BRANCH", "main")
-
-    yaml_content = yaml.dump(
-        {"barras": stock},
-        sort_keys=False,
-        allow_unicode=True,
-    )
-
-    repo.update_file(
-        path=STOCK_FILE,
-        message="Actualizar stock de aluminio",
-        content=yaml_content,
-        sha=sha,
-        branch=branch,
-    )
-
-    # Refresh cache after successful save
-    load_stock.clear()
\ No newline at end of file
+def save_stock_changes(removed=(), added=(), modified=(), message=None):
+    """
+    Save only a delta of the stock: removed and added bars, and modified
+    (before, after) pairs. Raises StockConflict if a removed or modified
+    bar is no longer in the ledger.
+    """
+    with telemetry.stage("stock.guardar", cambios=len(removed) + len(added) + len(modified)):
+        stock_ledger().save_changes(removed, added, modified, message)
@@ -1,7 +1,9 @@
 import streamlit as st
 import pandas as pd
 
-from functions import load_stock, save_stock
+from catalog import load_catalog_cached
+from functions import load_stock, load_stock_index, save_stock_changes
+from stock_store import StockConflict
 
 
 # -------------------------------------------------
@@ -28,6 +30,45 @@ def sort_stock(df: pd.DataFrame) -> pd.DataFrame:
     )
 
 
+def row_hashes(df: pd.DataFrame) -> pd.Series:
+    """One hash per row of the stock columns, independent of dtypes."""
+    key = pd.DataFrame({
+        COL_POS: df[COL_POS].astype("string").str.strip(),
+        COL_CODE: pd.to_numeric(df[COL_CODE], errors="coerce").astype("Float64"),
+        COL_LENGTH: pd.to_numeric(df[COL_LENGTH], errors="coerce").astype("Float64"),
+    }, index=df.index)
+    return pd.util.hash_pandas_object(key, index=False)
+
+
+def diff_stock_rows(original: pd.DataFrame, edited: pd.DataFrame):
+    """
+    Changes between the loaded and the edited table, matching rows by index:
+    (added, removed, modified before, modified after).
+    """
+    common = original.index.intersection(edited.index)
+    changed = common[(row_hashes(original).loc[common] != row_hashes(edited).loc[common]).to_numpy()]
+    return (
+        edited.loc[edited.index.difference(original.index)],
+        original.loc[original.index.difference(edited.index)],
+        original.loc[changed],
+        edited.loc[changed],
+    )
+
+
+def describe_changes(added, removed, before, after) -> pd.DataFrame:
+    """Table of the pending changes, one row per bar."""
+    cols = [COL_POS, COL_CODE, COL_LENGTH]
+    parts = [
+        added[cols].assign(cambio="➕ Nueva", antes=""),
+        removed[cols].assign(cambio="🗑 Eliminada", antes=""),
+    ]
+    if not before.empty:
+        # built row by row: on an empty frame agg/apply return a DataFrame
+        previous = [" | ".join(map(str, row)) for row in before[cols].itertuples(index=False)]
+        parts.append(after[cols].assign(cambio="✏️ Modificada", antes=previous))
+    return pd.concat(parts)[["cambio", *cols, "antes"]]
+
+
 def prepare_stock(stock: list[dict]) -> pd.DataFrame:
     """Create the stock DataFrame."""
     df = pd.DataFrame(stock)
@@ -101,8 +142,9 @@ st.title("PROYECTO PINARDI - Control de stock")
 # Load stock
 # -------------------------------------------------
 
-stock, sha = load_stock()
+stock, _ = load_stock()
 df_stock = prepare_stock(stock)
+stock_index = load_stock_index()
 
 
 # -------------------------------------------------
@@ -155,44 +197,101 @@ edited_df = st.data_editor(
 # Save
 # -------------------------------------------------
 
-has_changes = not sort_stock(edited_df).equals(sort_stock(df_stock))
+added, removed, before, after = diff_stock_rows(df_stock, edited_df)
+has_changes = bool(len(added) or len(removed) or len(after))
+summary = f"{len(added)} nuevas, {len(removed)} eliminadas, {len(after)} modificadas"
 
 if has_changes:
-    changes_placeholder.warning("✏️ Hay cambios sin guardar.")
+    with changes_placeholder.container():
+        st.warning(f"✏️ Hay cambios sin guardar: {summary}.")
+        st.dataframe(
+            describe_changes(added, removed, before, after),
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                "cambio": "Cambio",
+                COL_POS: "Posición",
+                COL_CODE: "Código",
+                COL_LENGTH: "Largo (mm)",
+                "antes": "Antes",
+            },
+        )
+
 
-    
 if st.button(
     "💾 Guardar cambios",
     use_container_width=True,
     disabled=not has_changes,
 ):
 
-    validated_df, errors = validate_stock(edited_df)
+    # Only the new and modified rows need checking
+    validated_df, errors = validate_stock(pd.concat([added, after]))
 
     if errors:
         for error in errors:
             st.error(error)
         st.stop()
 
-    validated_df = sort_stock(validated_df)
-
-    # Nothing changed
-    if validated_df.equals(sort_stock(df_stock)):
-        st.info("ℹ️ No hay cambios para guardar.")
-        st.stop()
-
     try:
         with st.spinner("Guardando cambios..."):
 
-            save_stock(
-                validated_df.to_dict("records"),
-                sha,
+            save_stock_changes(
+                removed=removed.to_dict("records"),
+                added=validated_df.loc[added.index].to_dict("records"),
+                modified=list(zip(
+                    before.to_dict("records"),
+                    validated_df.loc[after.index].to_dict("records"),
+                )),
+                message=f"Stock: {summary}",
             )
 
         st.success("✅ Stock actualizado correctamente.")
         st.rerun()
 
+    except StockConflict as e:
+        st.error(
+            "❌ Otra persona cambió estas mismas barras mientras usted editaba. "
+            "No se guardó nada: revise el stock actual y repita estos cambios."
+        )
+        if e.conflicts:
+            st.dataframe(
+                prepare_stock(e.conflicts),
+                use_container_width=True,
+                hide_index=True,
+            )
+
     except Exception as e:
         st.error(
             f"No se pudo guardar el archivo en GitHub.\n\n{e}"
-        )
\ No newline at end of file
+        )
+
+
+# -------------------------------------------------
+# Queries
+# -------------------------------------------------
+
+with st.expander("🔎 Buscar barra para un corte", expanded=False):
+    col_code, col_length = st.columns(2)
+    with col_code:
+        query_code = st.selectbox("Código", stock_index.codes(), index=None)
+    with col_length:
+        query_length = st.number_input("Largo mínimo (mm)", value=0, step=1, min_value=0)
+
+    if query_code is not None:
+        best = stock_index.best_fit(query_code, query_length)
+        if best is None:
+            st.info("No hay barras de ese código con ese largo.")
+        else:
+            st.success(f"Mejor opción: {best[COL_POS]} - {best[COL_LENGTH]} mm")
+            st.dataframe(
+                pd.DataFrame(stock_index.at_least(query_code, query_length)),
+                use_container_width=True,
+                hide_index=True,
+            )
+
+with st.expander("📊 Totales por código y estante", expanded=False):
+    st.dataframe(
+        pd.DataFrame(stock_index.totals(load_catalog_cached(".").parts)),
+        use_container_width=True,
+        hide_index=True,
+    )
@@ -0,0 +1,148 @@
+"""
+Parts catalog stored in SQLite, for supplier lists too large for parts.yaml.
+
+Drop-in for the dict returned by catalog.load_parts: parts[code]["descripcion"]
+works the same, but a part is only read and decoded the first time it is
+looked up, so a quote touching twenty codes never loads the other fifty
+thousand. Codes are the primary key and tipo has its own index.
+
+    python parts_store.py lista_extrusora.csv --db parts.sqlite
+    python parts_store.py parts.yaml --db parts.sqlite
+"""
+import argparse
+import csv
+import json
+import sqlite3
+from collections.abc import Mapping
+from pathlib import Path
+
+PARTS_DB = "parts.sqlite"
+
+# CSV columns converted to numbers; anything else is kept as text
+NUMERIC_FIELDS = {"kg/m": float, "largo": int, "precio": float}
+
+
+def _code(value):
+    """Codes are ints in parts.yaml; keep alphanumeric ones as text."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return str(value).strip()
+
+
+class PartsStore(Mapping):
+    """Read-only, lazily decoded {codigo: part} mapping over a SQLite file."""
+
+    def __init__(self, path=PARTS_DB):
+        self.path = Path(path)
+        self._rows = {}
+        if not self.path.exists():
+            raise FileNotFoundError(f"No existe la base de piezas {self.path}")
+
+    def _connect(self):
+        # Read-only URI, so a lookup can never create or lock the .sqlite file
+        return sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=10)
+
+    def __getitem__(self, code):
+        part = self._rows.get(code)
+        if part is None:
+            with self._connect() as db:
+                row = db.execute("SELECT datos FROM parts WHERE codigo = ?", (code,)).fetchone()
+            if row is None:
+                raise KeyError(code)
+            part = self._rows[code] = json.loads(row[0])
+        return part
+
+    def __contains__(self, code):
+        return code in self.load([code])
+
+    def __iter__(self):
+        with self._connect() as db:
+            codes = [c for (c,) in db.execute("SELECT codigo FROM parts ORDER BY codigo")]
+        return iter(codes)
+
+    def __len__(self):
+        with self._connect() as db:
+            return db.execute("SELECT COUNT(*) FROM parts").fetchone()[0]
+
+    def codes_by_tipo(self, tipo):
+        """Codes of one tipo ("perfil", "accesorio"...), via the tipo index."""
+        with self._connect() as db:
+            return [c for (c,) in db.execute("SELECT codigo FROM parts WHERE tipo = ? ORDER BY codigo", (tipo,))]
+
+    def load(self, codes):
+        """Fetch several parts in one query (e.g. every code of a quote)."""
+        missing = [c for c in codes if c not in self._rows]
+        if missing:
+            with self._connect() as db:
+                for i in range(0, len(missing), 500):
+                    chunk = missing[i:i + 500]
+                    rows = db.execute(
+                        f"SELECT codigo, datos FROM parts WHERE codigo IN ({','.join('?' * len(chunk))})", chunk
+                    )
+                    self._rows.update((c, json.loads(d)) for c, d in rows)
+        return {c: self._rows[c] for c in codes if c in self._rows}
+
+    def __getstate__(self):
+        # Pickled with the catalog snapshot: keep the path, not the rows read so far
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self._rows = {}
+
+
+def create_store(path, parts):
+    """
+    Write {codigo: part} into a new SQLite store at path, replacing it.
+
+    parts may be any iterable of (codigo, part) pairs, so a large CSV is
+    imported without holding it in memory.
+    """
+    path = Path(path)
+    tmp = path.with_suffix(".tmp")
+    tmp.unlink(missing_ok=True)
+    with sqlite3.connect(tmp) as db:
+        db.execute("CREATE TABLE parts (codigo PRIMARY KEY, tipo TEXT, datos TEXT NOT NULL) WITHOUT ROWID")
+        db.executemany(
+            "INSERT OR REPLACE INTO parts (codigo, tipo, datos) VALUES (?, ?, ?)",
+            ((code, part.get("tipo"), json.dumps(part, ensure_ascii=False)) for code, part in parts),
+        )
+        db.execute("CREATE INDEX parts_tipo ON parts (tipo)")
+    db.close()
+    tmp.replace(path)
+    return PartsStore(path)
+
+
+def parts_from_csv(csv_path):
+    """(codigo, part) pairs from a CSV with a codigo column plus part fields."""
+    with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f):
+            code = _code(row.pop("codigo"))
+            part = {}
+            for field, value in row.items():
+                value = (value or "").strip()
+                if value == "":
+                    continue
+                convert = NUMERIC_FIELDS.get(field)
+                part[field] = convert(value.replace(",", ".")) if convert else value
+            yield code, part
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importa la lista de piezas a una base SQLite.")
+    parser.add_argument("origen", help="Archivo CSV (columna codigo + campos) o parts.yaml.")
+    parser.add_argument("--db", default=PARTS_DB, help=f"Base de salida (default: {PARTS_DB}).")
+    args = parser.parse_args(argv)
+
+    if Path(args.origen).suffix in (".yaml", ".yml"):
+        from catalog import load_parts
+        parts = load_parts(args.origen).items()
+    else:
+        parts = parts_from_csv(args.origen)
+    store = create_store(args.db, parts)
+    print(f"{len(store)} piezas -> {args.db}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,69 +1,95 @@
+import hashlib
 import io
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+
+import pandas as pd
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, LongTable, TableStyle
+from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfbase.pdfmetrics import stringWidth
 
-def generate_pdf(df_cuts_flat, parts):
-    buffer = io.BytesIO()
+import telemetry
 
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
-    styles = getSampleStyleSheet()
+FONT = "Helvetica"
+FONT_SIZE = 8
+PADDING = 6  # left + right cell padding of the default TableStyle
 
-    # Style for wrapped table content
-    cell_style = ParagraphStyle(
-        "table_cell",
-        parent=styles["BodyText"],
-        fontName="Helvetica",
-        fontSize=8,
-        leading=10,
-        wordWrap="CJK"
-    )
+# groups longer than this are laid out as LongTable (faster for long tables)
+LONG_TABLE_ROWS = 100
 
-    story = []
+TABLE_STYLE = TableStyle([
+    ("FONT", (0, 0), (-1, -1), FONT, FONT_SIZE, FONT_SIZE + 2),
+    ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),
+    ("GRID", (0, 0), (-1, -1), 0.5, colors.grey),
+    ("VALIGN", (0, 0), (-1, -1), "TOP")
+])
 
-    PAGE_WIDTH, _ = A4
-    usable_width = PAGE_WIDTH - doc.leftMargin - doc.rightMargin
 
-    # Title
-    story.append(Paragraph("Lista de Cortes", styles["Title"]))
-    story.append(Spacer(1, 12))
+def plan_key(df_cuts_flat):
+    """Hash of the cut list contents, to cache its PDF by."""
+    digest = hashlib.sha256(",".join(map(str, df_cuts_flat.columns)).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(df_cuts_flat, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
 
-    # Tables grouped by "Código"
-    for codigo, group in df_cuts_flat.groupby("Código"):
-        story.append(Paragraph(
-            f"<b>{codigo} - {parts[codigo]['descripcion']}</b>",
-            styles["Heading2"]
-        ))
-        story.append(Spacer(1, 6))
 
-        group_no_code = group.drop(columns="Código")
+def _cell(value, width):
+    """Plain cell text, wrapped onto lines only when it does not fit."""
+    text = str(value)
+    if stringWidth(text, FONT, FONT_SIZE) <= width:
+        return text
+    return "\n".join(simpleSplit(text, FONT, FONT_SIZE, width))
+
+
+def _section(codigo, group, parts, usable_width, styles):
+    """Heading and table of one code."""
+    group_no_code = group.drop(columns="Código")
+
+    # Fit table to page width
+    num_cols = len(group_no_code.columns)
+    col_widths = [usable_width / num_cols] * num_cols
+    text_width = usable_width / num_cols - PADDING
+
+    # Plain strings: Paragraph per cell is what made large lists slow
+    header = [_cell(col, text_width) for col in group_no_code.columns]
+    rows = [
+        [_cell(cell, text_width) for cell in row]
+        for row in group_no_code.itertuples(index=False)
+    ]
 
-        # Header and rows as wrapped Paragraphs
-        header = [Paragraph(str(col), cell_style) for col in group_no_code.columns]
-        rows = [
-            [Paragraph(str(cell), cell_style) for cell in row]
-            for row in group_no_code.values
-        ]
+    table_class = LongTable if len(rows) > LONG_TABLE_ROWS else Table
+    table = table_class([header] + rows, colWidths=col_widths, repeatRows=1)
+    table.setStyle(TABLE_STYLE)
 
-        table_data = [header] + rows
+    return [
+        Paragraph(f"<b>{codigo} - {parts[codigo]['descripcion']}</b>", styles["Heading2"]),
+        Spacer(1, 6),
+        table,
+        Spacer(1, 12),
+    ]
 
-        # Fit table to page width
-        num_cols = len(group_no_code.columns)
-        col_widths = [usable_width / num_cols] * num_cols
 
-        table = Table(table_data, colWidths=col_widths)
+def generate_pdf(df_cuts_flat, parts):
+    with telemetry.stage("pdf", filas=len(df_cuts_flat)):
+        return _generate_pdf(df_cuts_flat, parts)
+
+
+def _generate_pdf(df_cuts_flat, parts):
+    buffer = io.BytesIO()
+
+    doc = SimpleDocTemplate(buffer, pagesize=A4)
+    styles = getSampleStyleSheet()
 
-        table.setStyle(TableStyle([
-            ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),
-            ("GRID", (0, 0), (-1, -1), 0.5, colors.grey),
-            ("VALIGN", (0, 0), (-1, -1), "TOP")
-        ]))
+    PAGE_WIDTH, _ = A4
+    usable_width = PAGE_WIDTH - doc.leftMargin - doc.rightMargin
 
-        story.append(table)
-        story.append(Spacer(1, 12))
+    # Title
+    story = [Paragraph("Lista de Cortes", styles["Title"]), Spacer(1, 12)]
+
+    # Tables grouped by "Código"
+    for codigo, group in df_cuts_flat.groupby("Código"):
+        story.extend(_section(codigo, group, parts, usable_width, styles))
 
     doc.build(story)
     buffer.seek(0)
     return buffer
-
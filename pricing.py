@@ -0,0 +1,46 @@
+"""
+Quote pricing: margins, discounts and VAT.
+
+Every concept is taxed at IVA, or with iva_a_todo=False only the material
+purchases listed in COMPRAS.
+"""
+import pandas as pd
+
+IVA = 1.22
+
+# Concepts that are purchases (VAT always applies)
+COMPRAS = ["Subtotal perfiles", "Subtotal accesorios", "Subtotal vidrios"]
+
+
+def percentage(value, percent):
+    """percent % of value (margins)."""
+    return value * percent / 100
+
+
+def discounted(value, percent):
+    """value with a percent % discount."""
+    return value * (1 - percent / 100)
+
+
+def build_quote(conceptos, iva_a_todo=True):
+    """
+    Final quote table.
+
+    conceptos maps each concept to its value, in display order. VAT applies
+    to every concept, or only to purchases when iva_a_todo is False.
+
+    Returns (df, total_sin_iva, total_iva_incluido); df has the columns
+    Concepto, Valor, Multiplicador and Total.
+    """
+    df = pd.DataFrame({"Concepto": list(conceptos), "Valor": list(conceptos.values())})
+
+    if iva_a_todo:
+        df["Multiplicador"] = IVA
+    else:
+        df["Multiplicador"] = df["Concepto"].apply(
+            lambda c: IVA if c in COMPRAS else 1.00
+        )
+
+    df["Total"] = df["Valor"] * df["Multiplicador"]
+
+    return df, df["Valor"].sum(), df["Total"].sum()
@@ -0,0 +1,153 @@
+import functools
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+from cutting_stock import SOLVER_VERSION, as_demand
+
+CACHE_FILE = ".cache/cortes.sqlite"
+
+
+def _to_builtin(value):
+    """json fallback for NumPy scalars coming from pandas."""
+    return value.item()
+
+
+class SolutionCache:
+    """
+    Persistent, content-addressed cache of cutting plans (SQLite).
+
+    Entries are keyed by a hash of the stock length, the sorted piece
+    multiset, kerf, edge trim, remnants, min_remnant, seed, engine and
+    solver version, so identical sub-jobs return instantly across reruns,
+    sessions and restarts. When the stored payloads exceed max_bytes the
+    least recently used are evicted.
+    """
+
+    def __init__(self, path=CACHE_FILE, max_bytes=50 * 1024 * 1024):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS solutions ("
+                "key TEXT PRIMARY KEY, payload TEXT NOT NULL, "
+                "size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS solutions_lru ON solutions (last_used)")
+            db.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def _connect(self):
+        # One short-lived connection per call: safe across Streamlit threads
+        return sqlite3.connect(self.path, timeout=10)
+
+    def _count(self, db, name):
+        db.execute(
+            "INSERT INTO counters (name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,),
+        )
+
+    @staticmethod
+    def key(engine, stock_length, pieces, kerf=0.0, edge_trim=0, remnants=None, min_remnant=None, seed=None):
+        """
+        Canonical hash of one cutting sub-job (remnants: stock bars used;
+        seed only when one was chosen, so default keys stay the same).
+        """
+        fields = {
+            "engine": engine,
+            "version": SOLVER_VERSION,
+            "stock_length": float(stock_length),
+            "pieces": [[float(l), int(d)] for l, d in sorted(as_demand(pieces))],
+            "kerf": float(kerf),
+            "edge_trim": float(edge_trim),
+            "remnants": sorted([float(r["largo"]), str(r["posicion"]), int(r["codigo"])] for r in remnants or []),
+            "min_remnant": float(min_remnant or 0),
+        }
+        if seed is not None:
+            fields["seed"] = int(seed)
+        canonical = json.dumps(fields, sort_keys=True)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return the plan stored for key (the cutting function's result tuple), or None on a miss."""
+        with self._connect() as db:
+            row = db.execute("SELECT payload FROM solutions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._count(db, "misses")
+                return None
+            db.execute("UPDATE solutions SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._count(db, "hits")
+        return tuple(json.loads(row[0])["plan"])
+
+    def put(self, key, *plan):
+        payload = json.dumps({"plan": plan}, default=_to_builtin)
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO solutions (key, payload, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, payload, len(payload), time.time()),
+            )
+            self._evict(db)
+
+    def _evict(self, db):
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM solutions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in db.execute("SELECT key, size FROM solutions ORDER BY last_used").fetchall():
+            db.execute("DELETE FROM solutions WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self):
+        """Hit/miss counters plus current number of entries and bytes."""
+        with self._connect() as db:
+            counters = dict(db.execute("SELECT name, value FROM counters").fetchall())
+            entries, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM solutions").fetchone()
+        return {
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+            "entries": entries,
+            "bytes": size,
+        }
+
+    # options of the cutting functions that only change how a plan is searched
+    SEARCH_OPTIONS = ("num_workers", "time_limit", "stats", "on_solution", "stop", "previous")
+
+    def cached(self, engine):
+        """
+        Decorator for a cutting function with the cutting_stock_with_kerf
+        signature (or cutting_stock_with_remnants', with remnants as a
+        keyword); the whole result tuple is stored and returned. min_remnant,
+        seed and remnants are part of the key, SEARCH_OPTIONS are not and any
+        other option raises TypeError. On a hit, stats gets status "CACHE".
+        Infeasible results and plans cut short by stop are not stored.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(stock_length, pieces, kerf=0.0, edge_trim=0, remnants=None, min_remnant=None, seed=None,
+                        **options):
+                unknown = set(options) - set(self.SEARCH_OPTIONS)
+                if unknown:
+                    raise TypeError(f"{engine}: options not covered by the cache key: {sorted(unknown)}")
+                key = self.key(engine, stock_length, pieces, kerf, edge_trim, remnants, min_remnant, seed)
+                hit = self.get(key)
+                if hit is not None:
+                    if options.get("stats") is not None:
+                        options["stats"]["status"] = "CACHE"
+                    return hit
+                plan = {"remnants": remnants} if remnants is not None else {}
+                if min_remnant is not None:
+                    plan["min_remnant"] = min_remnant
+                if seed is not None:
+                    plan["seed"] = seed
+                result = func(stock_length, pieces, kerf=kerf, edge_trim=edge_trim, **plan, **options)
+                stop = options.get("stop")
+                if result[0] is not None and not (stop and stop.is_set()):
+                    self.put(key, *result)
+                return result
+            return wrapper
+        return decorator
@@ -0,0 +1,176 @@
+"""
+Stock ledger of aluminium bars (stock_aluminio.yaml).
+
+Parsing, serialization, the length index and plan bookkeeping, with no
+Streamlit or network imports. Storage lives in stock_store.py, behind
+FileStockBackend (local file) and GitHubStockBackend.
+"""
+from bisect import bisect_left
+from collections import Counter
+
+import yaml
+
+# libyaml's C parser when available, several times faster than pure Python
+# (the catalog loader uses it too)
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+STOCK_FILE = "stock_aluminio.yaml"
+
+
+def stock_from_yaml(text):
+    """Parse the ledger YAML into the list of bars."""
+    data = yaml.load(text, Loader=YamlLoader)
+
+    if data is None:
+        data = {}
+
+    return data.get("barras", [])
+
+
+def stock_to_yaml(stock):
+    """Serialize the list of bars back to the ledger YAML."""
+    return yaml.dump(
+        {"barras": stock},
+        sort_keys=False,
+        allow_unicode=True,
+    )
+
+
+class StockIndex:
+    """
+    Read-only index of the ledger: per code, the bars sorted by length.
+
+    Length queries bisect the sorted lengths instead of scanning the whole
+    ledger. The bars are the ledger's own dicts, not copies: do not modify.
+    """
+
+    def __init__(self, stock):
+        by_code = {}
+        for bar in stock:
+            by_code.setdefault(int(bar["codigo"]), []).append(bar)
+        self._bars = {}
+        self._lengths = {}
+        for code, bars in by_code.items():
+            bars.sort(key=lambda b: b["largo"])
+            self._bars[code] = bars
+            self._lengths[code] = [b["largo"] for b in bars]
+        self._totals = {}
+        for bar in stock:
+            row = self._totals.setdefault((int(bar["codigo"]), str(bar["posicion"])), [0, 0])
+            row[0] += 1
+            row[1] += bar["largo"]
+
+    def __len__(self):
+        return sum(len(b) for b in self._bars.values())
+
+    def codes(self):
+        return sorted(self._bars)
+
+    def bars(self, codigo):
+        """Every bar of codigo, shortest first."""
+        return list(self._bars.get(int(codigo), ()))
+
+    def at_least(self, codigo, largo):
+        """Bars of codigo at least largo mm long, shortest first."""
+        codigo = int(codigo)
+        if codigo not in self._bars:
+            return []
+        return self._bars[codigo][bisect_left(self._lengths[codigo], largo):]
+
+    def best_fit(self, codigo, largo):
+        """Shortest bar of codigo that is at least largo mm long, or None."""
+        codigo = int(codigo)
+        if codigo not in self._bars:
+            return None
+        i = bisect_left(self._lengths[codigo], largo)
+        return self._bars[codigo][i] if i < len(self._bars[codigo]) else None
+
+    def totals(self, parts=None):
+        """
+        Rows of bars, mm and kg per code and shelf (kg only when parts,
+        with their kg/m, are given).
+        """
+        rows = []
+        for (codigo, posicion), (count, mm) in sorted(self._totals.items()):
+            row = {"codigo": codigo, "posicion": posicion, "barras": count, "mm": mm}
+            if parts is not None:
+                row["kg"] = round(mm / 1000 * parts[codigo]["kg/m"], 2) if codigo in parts else None
+            rows.append(row)
+        return rows
+
+
+def update_stock_with_plan(stock, used_bars, remnants):
+    """
+    Apply a confirmed cutting plan to the stock list.
+
+    Removes the stock bars the plan cuts from and appends the reusable
+    remnants it leaves. Raises ValueError if a used bar is no longer in
+    stock (someone else took it meanwhile).
+    """
+    stock = list(stock)
+    for bar in used_bars:
+        for i, b in enumerate(stock):
+            if (b["posicion"], b["codigo"], b["largo"]) == (bar["posicion"], bar["codigo"], bar["largo"]):
+                stock.pop(i)
+                break
+        else:
+            raise ValueError(
+                f"La barra {bar['codigo']} de {bar['posicion']} ({bar['largo']} mm) ya no está en el stock."
+            )
+    return stock + list(remnants)
+
+
+def bar_key(bar):
+    """Identity of a stock row: a bar is its shelf, code and length."""
+    return (str(bar["posicion"]), int(bar["codigo"]), int(bar["largo"]))
+
+
+def diff_stock(base, edited):
+    """(removed, added) rows from base to edited, compared as multisets."""
+    before = Counter(map(bar_key, base))
+    after = Counter(map(bar_key, edited))
+    return _take(base, before - after), _take(edited, after - before)
+
+
+def _take(stock, counts):
+    """The rows of stock matching counts, in stock order."""
+    counts = Counter(counts)
+    return [bar for bar in stock if _consume(counts, bar_key(bar))]
+
+
+def apply_stock_changes(stock, removed=(), added=(), modified=()):
+    """
+    Apply a delta to the ledger: drop the removed bars, replace each
+    (before, after) pair of modified in place and append the added bars.
+
+    Returns (new stock, conflicts): conflicts are the removed or modified
+    bars stock no longer has. When there are conflicts, new stock is None.
+    """
+    replacements = {}
+    for before, after in modified:
+        replacements.setdefault(bar_key(before), []).append(after)
+    wanted = Counter(map(bar_key, removed)) + Counter(map(bar_key, (before for before, _ in modified)))
+
+    available = Counter(map(bar_key, stock))
+    conflicts = [
+        bar for bar in [*removed, *(before for before, _ in modified)]
+        if not _consume(available, bar_key(bar))
+    ]
+    if conflicts:
+        return None, conflicts
+
+    new_stock = []
+    for bar in stock:
+        key = bar_key(bar)
+        if not _consume(wanted, key):
+            new_stock.append(bar)
+        elif replacements.get(key):
+            new_stock.append(replacements[key].pop(0))
+    return new_stock + list(added), []
+
+
+def _consume(counts, key):
+    if counts[key] > 0:
+        counts[key] -= 1
+        return True
+    return False
@@ -0,0 +1,245 @@
+"""
+Storage backends for the stock ledger, behind an in-memory read-through cache.
+
+Saves are optimistic: each one names the version it was based on, and when
+storage moved on meanwhile the two edits are merged bar by bar, or a
+StockConflict lists the bars both of them touched.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from stock import STOCK_FILE, StockIndex, apply_stock_changes, diff_stock, stock_from_yaml, stock_to_yaml
+
+MIRROR_DIR = ".cache"
+
+
+class StockConflict(Exception):
+    """
+    The ledger changed in storage since the version the save was based on.
+
+    conflicts lists the bars both edits touched, when a merge was attempted.
+    """
+
+    def __init__(self, message, conflicts=()):
+        super().__init__(message)
+        self.conflicts = list(conflicts)
+
+
+def _version(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class FileStockBackend:
+    """Ledger in a local YAML file; the version is the hash of its content."""
+
+    def __init__(self, path=STOCK_FILE):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def fetch(self):
+        """(yaml text, version) currently stored."""
+        text = self.path.read_text(encoding="utf-8") if self.path.exists() else ""
+        return text, _version(text)
+
+    def write(self, text, version, message=None):
+        """Store text if the file is still at version; return the new version."""
+        with self._lock:
+            if self.fetch()[1] != version:
+                raise StockConflict(f"{self.path} cambió desde la última lectura.")
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(text, encoding="utf-8")
+            os.replace(tmp, self.path)
+        return _version(text)
+
+
+class GitHubStockBackend:
+    """
+    Ledger in a GitHub repository, mirrored to a local file.
+
+    The mirror (text plus blob SHA) lets a restarted server answer before the
+    first request to GitHub finishes. Once the file has been downloaded,
+    later fetches are conditional on its ETag, so an unchanged ledger costs
+    a 304 and no download.
+    """
+
+    def __init__(self, get_repo, path=STOCK_FILE, branch="main", mirror_dir=MIRROR_DIR):
+        self.get_repo = get_repo
+        self.path = path
+        self.branch = branch
+        self.mirror = Path(mirror_dir) / f"{Path(path).stem}.{branch}.json"
+        self._content = None  # last ContentFile, carries the ETag
+
+    def mirrored(self):
+        """(text, sha) from the local mirror, or None."""
+        try:
+            data = json.loads(self.mirror.read_text(encoding="utf-8"))
+            return data["text"], data["sha"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _save_mirror(self, text, sha):
+        self.mirror.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.mirror.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"text": text, "sha": sha}), encoding="utf-8")
+        os.replace(tmp, self.mirror)
+
+    def fetch(self):
+        if self._content is None:
+            self._content = self.get_repo().get_contents(self.path, ref=self.branch)
+            changed = True
+        else:
+            changed = self._content.update()
+        sha = self._content.sha
+        mirror = self.mirrored()
+        if not changed and mirror is not None and mirror[1] == sha:
+            return mirror
+        text = self._content.decoded_content.decode("utf-8")
+        self._save_mirror(text, sha)
+        return text, sha
+
+    def write(self, text, version, message=None):
+        from github import GithubException
+
+        try:
+            result = self.get_repo().update_file(
+                path=self.path,
+                message=message or "Actualizar stock de aluminio",
+                content=text,
+                sha=version,
+                branch=self.branch,
+            )
+        except GithubException as e:
+            if e.status in (409, 422):
+                raise StockConflict(f"{self.path} cambió en GitHub desde la última lectura.") from e
+            raise
+        sha = result["content"].sha
+        self._content = None  # the PUT response has no ETag to condition on
+        self._save_mirror(text, sha)
+        return sha
+
+
+class StockLedger:
+    """
+    Read-through cache of a stock backend.
+
+    load() answers from memory. When the copy is older than max_age, a
+    background thread refreshes it and the caller keeps the current one, so
+    pages never wait on the network once the ledger has been read. Only the
+    first read (with no mirror to start from) and load(fresh=True) block.
+    """
+
+    def __init__(self, backend, max_age=30, retries=4, backoff=0.5):
+        self.backend = backend
+        self.max_age = max_age
+        self.retries = retries
+        self.backoff = backoff
+        self._bases = {}  # version -> text, the snapshots handed out by load()
+        self.error = None  # last background refresh failure, if any
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._text = None
+        self._stock = None
+        self._index = None
+        self._version = None
+        self._fetched_at = 0.0
+        mirrored = getattr(backend, "mirrored", None)
+        if mirrored is not None and mirrored() is not None:
+            self._set(*mirrored(), fetched_at=0.0)
+
+    def _set(self, text, version, fetched_at=None):
+        with self._lock:
+            if text != self._text:
+                self._stock = stock_from_yaml(text)
+                self._index = StockIndex(self._stock)
+            self._text = text
+            self._version = version
+            self._bases[version] = text
+            while len(self._bases) > 16:
+                del self._bases[next(iter(self._bases))]
+            self._fetched_at = time.monotonic() if fetched_at is None else fetched_at
+
+    def refresh(self):
+        """Fetch from the backend now (blocking)."""
+        self._set(*self.backend.fetch())
+        self.error = None
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:  # keep serving the cached copy
+                self.error = e
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name="stock-refresh", daemon=True).start()
+
+    def _current(self, fresh):
+        if fresh or self._stock is None:
+            self.refresh()
+        elif time.monotonic() - self._fetched_at > self.max_age:
+            self._refresh_in_background()
+
+    def load(self, fresh=False):
+        """(list of bars, version), a copy safe to modify."""
+        self._current(fresh)
+        with self._lock:
+            return [dict(b) for b in self._stock], self._version
+
+    def index(self, fresh=False):
+        """StockIndex of the ledger, rebuilt only when its content changes."""
+        self._current(fresh)
+        with self._lock:
+            return self._index
+
+    def save(self, stock, version):
+        """
+        Store stock, an edit of the ledger at version.
+
+        The edit is turned into a row delta against that version and applied
+        with save_changes, so changes other people stored meanwhile are kept
+        (three-way merge). Raises StockConflict with the bars both touched.
+        """
+        base_text = self._bases.get(version)
+        if base_text is None:  # unknown base: plain optimistic write
+            text = stock_to_yaml(stock)
+            self._set(text, self.backend.write(text, version))
+            return self._version
+        removed, added = diff_stock(stock_from_yaml(base_text), stock)
+        return self.save_changes(removed, added)
+
+    def save_changes(self, removed=(), added=(), modified=(), message=None):
+        """
+        Apply a row delta (see stock.apply_stock_changes) to the current
+        ledger and store it, re-reading and retrying with exponential backoff
+        if the ledger changed in storage meanwhile. Raises StockConflict when
+        a removed or modified bar is no longer in the ledger.
+        """
+        if self._stock is None:
+            self.refresh()
+        for attempt in range(self.retries + 1):
+            with self._lock:
+                current, version = self._stock, self._version
+            stock, conflicts = apply_stock_changes(current, removed, added, modified)
+            if conflicts:
+                if attempt > 0:  # already re-read: the bars really are gone
+                    raise StockConflict("Otra persona modificó las mismas barras.", conflicts)
+            else:
+                text = stock_to_yaml(stock)
+                try:
+                    self._set(text, self.backend.write(text, version, message))
+                    return self._version
+                except StockConflict:
+                    if attempt == self.retries:
+                        raise
+                time.sleep(self.backoff * 2 ** attempt)
+            self.refresh()
@@ -0,0 +1,65 @@
+"""
+Lightweight instrumentation: stage timings and solver statistics.
+
+Every stage and solve is logged as one JSON line on the "pinardi.telemetry"
+logger (set TELEMETRIA=1 to print them to stderr). Inside a Streamlit rerun
+they are also collected into the current Run, which the app shows in its
+diagnostics panel. Pure Python, safe to import from engine modules and
+pool workers; with nobody listening a stage costs two perf_counter calls.
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import time
+
+log = logging.getLogger("pinardi.telemetry")
+if os.environ.get("TELEMETRIA"):
+    log.setLevel(logging.INFO)
+    log.addHandler(logging.StreamHandler())
+
+_current_run = contextvars.ContextVar("telemetry_run", default=None)
+
+
+class Run:
+    """Stage timings and per-code solver stats of one rerun."""
+
+    def __init__(self):
+        self.stages = []
+        self.solves = {}
+
+
+def start_run():
+    """Start collecting for the calling thread (one Streamlit rerun)."""
+    run = Run()
+    _current_run.set(run)
+    return run
+
+
+def event(kind, **fields):
+    """Log one structured line."""
+    if log.isEnabledFor(logging.INFO):
+        log.info(json.dumps({"event": kind, **fields}, default=str, ensure_ascii=False))
+
+
+@contextlib.contextmanager
+def stage(name, **fields):
+    """Time the block as stage name; extra fields go to the log line."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = round(time.perf_counter() - start, 4)
+        run = _current_run.get()
+        if run is not None:
+            run.stages.append({"etapa": name, "segundos": seconds, **fields})
+        event("stage", stage=name, seconds=seconds, **fields)
+
+
+def record_solve(code, stats):
+    """Solver stats of one code, for the current run and the log."""
+    run = _current_run.get()
+    if run is not None:
+        run.solves[code] = stats
+    event("solve", code=code, **stats)